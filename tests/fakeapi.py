@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# A stand-in for api.APIRequest, so the tests make no requests
+
+import threading
+import unittest
+
+from wikitools import api, wiki
+
+# Function taking the request parameters and returning the response
+handler = None
+
+class FakeRequest(object):
+	"""Stands in for api.APIRequest, answers with handler"""
+	calls = []
+	lock = threading.Lock()
+
+	def __init__(self, site, data, write=False, multipart=False):
+		self.site = site
+		self.data = dict(data)
+
+	def changeParam(self, param, value):
+		self.data[param] = value
+
+	def query(self, querycontinue=True):
+		return self.__call(dict(self.data))
+
+	def queryGen(self, checkpoint=None):
+		params = dict(self.data)
+		if checkpoint is not None:
+			state = checkpoint.start(self.data)
+			if checkpoint.done:
+				return
+			if state:
+				params.update(state)
+		try:
+			while True:
+				res = self.__call(dict(params))
+				yield res
+				if checkpoint is not None:
+					checkpoint.update(res.get('continue'))
+				if 'continue' not in res:
+					break
+				params.update(res['continue'])
+		finally:
+			if checkpoint is not None:
+				checkpoint.save()
+
+	def __call(self, params):
+		FakeRequest.lock.acquire()
+		try:
+			FakeRequest.calls.append(params)
+		finally:
+			FakeRequest.lock.release()
+		if params.get('meta') == 'siteinfo' or handler is None:
+			raise api.APIError('no siteinfo')
+		return handler(params)
+
+def setHandler(func):
+	global handler
+	handler = func
+
+def makeSite():
+	site = wiki.Wiki('http://example.org/w/api.php')
+	site.siteinfo = {'case':'first-letter'}
+	names = {0:u'', 1:u'Talk', 2:u'User', 6:u'File', 10:u'Template', 14:u'Category'}
+	for (ns, name) in names.items():
+		site.namespaces[ns] = {'id':ns, '*':name, 'case':'first-letter'}
+		if ns:
+			site.namespaces[ns]['canonical'] = name
+	return site
+
+class FakeAPITest(unittest.TestCase):
+	def setUp(self):
+		self.realRequest = api.APIRequest
+		api.APIRequest = FakeRequest
+		setHandler(None)
+		self.site = makeSite()
+		FakeRequest.calls[:] = []
+
+	def tearDown(self):
+		api.APIRequest = self.realRequest
+		setHandler(None)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Tests for wikitools.editqueue, run with: python -m unittest discover tests
+
+import unittest
+
+from wikitools import page, editqueue
+from fakeapi import FakeRequest, FakeAPITest, setHandler
+
+def editHandler(params):
+	if params['action'] == 'edit':
+		return {'edit':{'result':'Success', 'newrevid':2}}
+	pages = {}
+	for title in params['titles'].split('|'):
+		pageid = ord(title[0])
+		pages[str(pageid)] = {'pageid':pageid, 'ns':0, 'title':title, 'lastrevid':1, 'touched':'2020-01-01T00:00:00Z',
+			'revisions':[{'*':u'old text', 'timestamp':'2020-01-01T00:00:00Z', 'revid':1}]}
+	return {'query':{'pages':pages}}
+
+def badTransform(text):
+	raise ValueError('bad text')
+
+class EditQueueTest(FakeAPITest):
+	def testTransformError(self):
+		setHandler(editHandler)
+		self.site.tokens['csrf'] = 'token'
+		a = page.Page(self.site, 'A', check=False)
+		b = page.Page(self.site, 'B', check=False)
+		queue = editqueue.EditQueue(self.site, workers=2)
+		queue.add(a, transform=badTransform)
+		queue.add(b, text='new text')
+		results = dict(queue.run())
+		self.assertTrue(isinstance(results[a], ValueError))
+		self.assertEqual(results[b]['edit']['result'], 'Success')
+		edits = [call for call in FakeRequest.calls if call['action'] == 'edit']
+		self.assertEqual([call['title'] for call in edits], ['B'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Tests for wikitools.page, run with: python -m unittest discover tests
+
+import unittest
+
+from wikitools import page
+from fakeapi import FakeRequest, FakeAPITest, setHandler
+
+def parseHandler(params):
+	# The page was edited since revision 5, section 1 is now 'New'
+	if 'oldid' in params:
+		return {'parse':{'revid':params['oldid'], 'sections':[{'line':'Old', 'anchor':'Old', 'index':'1'}]}}
+	return {'parse':{'revid':7, 'sections':[{'line':'New', 'anchor':'New', 'index':'1'}, {'line':'Old', 'anchor':'Old', 'index':'2'}]}}
+
+class SectionTest(FakeAPITest):
+	def testCurrentRevision(self):
+		setHandler(parseHandler)
+		p = page.Page(self.site, 'Foo', check=False)
+		p.lastrevid = 5
+		p.setSection('Old')
+		self.assertEqual(p.section, '2')
+		self.assertEqual(FakeRequest.calls[-1]['page'], 'Foo')
+
+	def testCachedByRevid(self):
+		setHandler(parseHandler)
+		p = page.Page(self.site, 'Foo', check=False)
+		p.lastrevid = 7
+		p.getSections()
+		p.getSections()
+		self.assertEqual(len(FakeRequest.calls), 1)
+		p.lastrevid = 8
+		p.getSections()
+		self.assertEqual(len(FakeRequest.calls), 2)
+
+	def testOldRevision(self):
+		setHandler(parseHandler)
+		p = page.Page(self.site, 'Foo', check=False)
+		self.assertEqual([s['line'] for s in p.getSections(revid=5)], ['Old'])
+		self.assertEqual(FakeRequest.calls[-1]['oldid'], 5)
+		p.getSections(revid=5)
+		self.assertEqual(len(FakeRequest.calls), 1)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Tests for wikitools.pagelist, run with: python -m unittest discover tests
+# No requests are made, api.APIRequest is replaced with FakeRequest
+
+import threading
+import time
+import unittest
+
+from wikitools import pagelist
+from fakeapi import FakeRequest, FakeAPITest, setHandler
+
+def revisionsHandler(params):
+	# Pages with ids from the first letter of the title, with text and info
+	pages = {}
+	for title in params['titles'].split('|'):
+		pageid = ord(title[0])
+		obj = {'pageid':pageid, 'ns':0, 'title':title}
+		if 'revisions' in params.get('prop', ''):
+			obj['revisions'] = [{'*':u'text of '+title, 'timestamp':'2020-01-01T00:00:00Z', 'revid':pageid*10, 'sha1':'x'}]
+		if 'info' in params.get('prop', ''):
+			obj['lastrevid'] = pageid*10
+			obj['touched'] = '2020-01-01T00:00:00Z'
+		pages[str(pageid)] = obj
+	return {'query':{'pages':pages}}
+
+class PageGroupTest(FakeAPITest):
+	def loadText(self, workers):
+		setHandler(revisionsHandler)
+		pages = pagelist.listFromTitles(self.site, ['A', 'B', 'C'], check=False, lazy=True)
+		pages[0].lazygroup.batch = 1
+		pages[0].lazygroup.workers = workers
+		result = []
+		t = threading.Thread(target=lambda: result.append([p.wikitext for p in pages]))
+		t.setDaemon(True)
+		t.start()
+		t.join(10)
+		self.assertTrue(result, "Loading the wikitext didn't finish")
+		self.assertEqual(result[0], ['text of A', 'text of B', 'text of C'])
+		# The info comes with the text, one request per batch
+		self.assertEqual(len(FakeRequest.calls), 3)
+		self.assertEqual([p.pageid for p in pages], [65, 66, 67])
+		self.assertEqual([p.lastrevid for p in pages], [650, 660, 670])
+		self.assertEqual(len(FakeRequest.calls), 3)
+
+	def testWikitextOneWorker(self):
+		self.loadText(1)
+
+	def testWikitextWorkers(self):
+		self.loadText(2)
+
+	def readDuringLoad(self, attr, handler):
+		# Thread A starts loading, then B reads another page of the group
+		setHandler(handler)
+		pages = pagelist.listFromTitles(self.site, ['A', 'B'], check=False, lazy=True)
+		results = {}
+		def read(index):
+			try:
+				results[index] = getattr(pages[index], attr)
+			except Exception, exc:
+				results[index] = exc
+		first = threading.Thread(target=read, args=(0,))
+		first.setDaemon(True)
+		first.start()
+		while not FakeRequest.calls:
+			time.sleep(0.01)
+		second = threading.Thread(target=read, args=(1,))
+		second.setDaemon(True)
+		second.start()
+		first.join(10)
+		second.join(10)
+		self.assertEqual(len(results), 2, "Loading didn't finish")
+		return results
+
+	def testReadDuringLoad(self):
+		def slowHandler(params):
+			time.sleep(0.2)
+			return revisionsHandler(params)
+		self.assertEqual(self.readDuringLoad('pageid', slowHandler), {0:65, 1:66})
+		FakeRequest.calls[:] = []
+		self.assertEqual(self.readDuringLoad('wikitext', slowHandler), {0:'text of A', 1:'text of B'})
+		self.assertEqual(len(FakeRequest.calls), 1)
+
+	def testFailedLoad(self):
+		# The first request fails, the thread waiting for it loads the page again
+		failures = [True]
+		def failingHandler(params):
+			time.sleep(0.2)
+			if failures:
+				failures.pop()
+				raise ValueError('request failed')
+			return revisionsHandler(params)
+		results = self.readDuringLoad('pageid', failingHandler)
+		self.assertTrue(isinstance(results[0], ValueError))
+		self.assertEqual(results[1], 66)
+
+# Names in the fake lists, the shard boundaries are in the list
+listNames = [u'A', u'B', u'B c', u'C', u'D', u'Da', u'E']
+
+def listItem(listkey, name):
+	# An item in the format each list module returns
+	pageid = listNames.index(name)+1
+	if listkey == 'allpages':
+		return {'pageid':pageid, 'ns':10, 'title':u'Template:'+name}
+	if listkey == 'allimages':
+		return {'name':name.replace(' ', '_'), 'ns':6, 'title':u'File:'+name}
+	if listkey == 'allcategories':
+		return {'*':name}
+	if listkey == 'allusers':
+		return {'userid':pageid, 'name':name}
+	return {'pageid':pageid, 'ns':0, 'title':name, 'sortkeyprefix':name}
+
+def listHandler(params):
+	# Like MediaWiki, from and to are inclusive, except the end sort key prefix
+	listkey = params['list']
+	(startparam, endparam, inclusive) = pagelist.shardParams[listkey]
+	start = params.get(startparam)
+	end = params.get(endparam)
+	items = []
+	for name in listNames:
+		if start is not None and name < start:
+			continue
+		if end is not None and (name > end or (name == end and not inclusive)):
+			continue
+		items.append(listItem(listkey, name))
+	return {'query':{listkey:items}}
+
+class ShardedQueryTest(FakeAPITest):
+	def runShards(self, listkey, params):
+		setHandler(listHandler)
+		params['action'] = 'query'
+		params['list'] = listkey
+		shards = pagelist.makeShards(3, ['B', 'D'])
+		self.assertEqual(shards, [(None, 'B'), ('B', 'D'), ('D', None)])
+		items = list(pagelist.shardedQuery(self.site, params, shards, workers=2))
+		self.assertEqual(len(FakeRequest.calls), 3)
+		return items
+
+	def testAllPages(self):
+		items = self.runShards('allpages', {'apnamespace':10})
+		self.assertEqual(sorted([item['title'] for item in items]), [u'Template:'+name for name in listNames])
+
+	def testAllImages(self):
+		items = self.runShards('allimages', {})
+		self.assertEqual(sorted([item['title'] for item in items]), [u'File:'+name for name in listNames])
+
+	def testAllCategories(self):
+		items = self.runShards('allcategories', {})
+		self.assertEqual(sorted([item['*'] for item in items]), listNames)
+
+	def testAllUsers(self):
+		items = self.runShards('allusers', {})
+		self.assertEqual(sorted([item['name'] for item in items]), listNames)
+
+	def testCategoryMembers(self):
+		items = self.runShards('categorymembers', {'cmtitle':'Category:Foo'})
+		self.assertEqual(sorted([item['title'] for item in items]), listNames)
+
+if __name__ == '__main__':
+	unittest.main()
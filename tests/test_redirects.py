@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Tests for wikitools.redirects, run with: python -m unittest discover tests
+
+import unittest
+
+from wikitools import redirects
+from fakeapi import FakeRequest, FakeAPITest, setHandler
+
+def preloadHandler(params):
+	# R1 -> R2 -> Target, with the chain resolved like the API does
+	if params.get('generator') != 'allpages':
+		raise AssertionError('Unexpected request: %r' % params)
+	return {'query':{
+		'redirects':[{'from':u'R1', 'to':u'R2'}, {'from':u'R2', 'to':u'Target'}],
+		'pages':{'10':{'pageid':10, 'ns':0, 'title':u'Target'}}
+	}}
+
+class PreloadTest(FakeAPITest):
+	def testNoRequests(self):
+		setHandler(preloadHandler)
+		resolver = redirects.RedirectResolver(self.site).preload()
+		self.assertEqual(len(FakeRequest.calls), 1)
+		self.assertTrue(resolver.isRedirect('R1'))
+		self.assertEqual(resolver.getTarget('R1'), u'Target')
+		self.assertEqual(resolver.resolve(['R2', 'Target']), {'R2':u'Target', 'Target':u'Target'})
+		self.assertFalse(resolver.isRedirect('Target'))
+		self.assertEqual(len(FakeRequest.calls), 1)
+
+if __name__ == '__main__':
+	unittest.main()
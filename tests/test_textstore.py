@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Tests for wikitools.textstore, run with: python -m unittest discover tests
+
+import unittest
+
+from wikitools import page, textstore
+from fakeapi import FakeAPITest, setHandler
+
+# Random enough that it doesn't compress to under the limits used
+bigText = ''.join([chr(32 + (i*7919) % 95) for i in range(1000)])
+
+def textHandler(params):
+	return {'query':{'pages':{'1':{'pageid':1, 'ns':0, 'title':u'Foo', 'lastrevid':1, 'touched':'2020-01-01T00:00:00Z',
+		'revisions':[{'*':unicode(bigText), 'timestamp':'2020-01-01T00:00:00Z', 'revid':1}]}}}}
+
+class Owner(object):
+	pass
+
+class TextStoreTest(FakeAPITest):
+	def testNewTextKept(self):
+		store = textstore.TextStore(maxsize=10, method='zlib')
+		first = Owner()
+		second = Owner()
+		store.put(first, bigText)
+		self.assertEqual(store.get(first), bigText)
+		store.put(second, bigText)
+		self.assertEqual(store.get(second), bigText)
+		self.assertEqual(store.get(first), None)
+
+	def testGetWikiTextOverLimit(self):
+		setHandler(textHandler)
+		self.site.setTextStore(textstore.TextStore(maxsize=10, method='zlib'))
+		p = page.Page(self.site, 'Foo', check=False)
+		self.assertEqual(p.getWikiText(), bigText)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Tests for wikitools.wikifile, run with: python -m unittest discover tests
+
+import hashlib
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from wikitools import wiki, wikifile
+from fakeapi import FakeAPITest, setHandler
+
+content = 'file content ' * 1000
+
+class FakeResponse(StringIO.StringIO):
+	code = 200
+
+class FakeOpener(object):
+	def __init__(self):
+		self.requests = []
+
+	def open(self, request):
+		self.requests.append(request)
+		return FakeResponse(content)
+
+def imageinfoHandler(url):
+	def handler(params):
+		info = {'url':url, 'size':len(content), 'sha1':hashlib.sha1(content).hexdigest()}
+		return {'query':{'pages':{'5':{'pageid':5, 'ns':6, 'title':u'File:Foo.jpg', 'imageinfo':[info]}}}}
+	return handler
+
+class DownloadTest(FakeAPITest):
+	def setUp(self):
+		FakeAPITest.setUp(self)
+		self.dir = tempfile.mkdtemp()
+		self.site.auth = 'user'
+		self.site.httppass = 'password'
+		self.opener = FakeOpener()
+		self.site.opener = self.opener
+		self.site.openercookies = self.site.cookies
+
+	def tearDown(self):
+		FakeAPITest.tearDown(self)
+		shutil.rmtree(self.dir)
+
+	def download(self, url):
+		setHandler(imageinfoHandler(url))
+		f = wikifile.File(self.site, 'File:Foo.jpg', check=False)
+		f.pageid = 5
+		location = f.download(location=os.path.join(self.dir, 'Foo.jpg'))
+		self.assertEqual(open(location, 'rb').read(), content)
+		return self.opener.requests[-1]
+
+	def testOtherHost(self):
+		request = self.download('http://upload.example.com/Foo.jpg')
+		self.assertFalse(request.has_header('Authorization'))
+
+	def testSameHost(self):
+		request = self.download('http://example.org/images/Foo.jpg')
+		self.assertTrue(request.has_header('Authorization'))
+
+	def testOpenerReused(self):
+		self.download('http://example.org/images/Foo.jpg')
+		self.download('http://example.org/images/Foo.jpg')
+		self.assertEqual(len(self.opener.requests), 2)
+		self.assertTrue(self.site.getOpener() is self.opener)
+
+class OpenerTest(FakeAPITest):
+	def testMadeOnce(self):
+		opener = self.site.getOpener()
+		self.assertTrue(self.site.getOpener() is opener)
+		self.site.cookies = wiki.WikiCookieJar()
+		self.assertFalse(self.site.getOpener() is opener)
+
+if __name__ == '__main__':
+	unittest.main()
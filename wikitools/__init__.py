@@ -15,10 +15,15 @@
  
 # You should have received a copy of the GNU General Public License
 # along with wikitools.  If not, see <http://www.gnu.org/licenses/>.
-__all__ = ["wiki", "api", "page", "category", "user", "pagelist", "wikifile"]
+__all__ = ["wiki", "api", "page", "category", "user", "pagelist", "wikifile", "revcache", "editqueue", "redirects", "textstore", "blockindex"]
 from wiki import *
 from api import *
 from page import *
 from category import *
 from user import *
 from wikifile import *
+from revcache import *
+from editqueue import *
+from redirects import *
+from textstore import *
+from blockindex import *
@@ -25,6 +25,9 @@ import wiki
 import base64
 import warnings
 import copy
+import threading
+import Queue
+import os
 from urllib import quote_plus, _is_unicode
 try:
 	from poster.encode import multipart_encode
@@ -167,34 +170,54 @@ for queries requring multiple requests""", FutureWarning)
 			data = self.__longQuery(data)
 		return data
 	
-	def queryGen(self):
+	def queryGen(self, checkpoint=None):
 		"""Unlike the old query-continue method that tried to stitch results
 		together, which could work poorly for complex result sets and could
 		use a lot of memory, this yield each set returned by the API and lets
 		the user process the data. 
 		Loosely based on the recommended implementation on mediawiki.org
 		
+		checkpoint - a QueryCheckpoint to record the progress in, if it has
+		progress from an earlier run of the same query, the query continues
+		from there. A set of results is recorded as done when the next one
+		is requested from the generator.
+		
 		"""
+		state = None
+		if checkpoint is not None:
+			state = checkpoint.start(self.data)
+			if checkpoint.done:
+				return
 		reqcopy = copy.deepcopy(self.request)
 		self.changeParam('continue', '')
-		while True:
-			data = False
-			while not data:
-				rawdata = self.__getRaw()
-				data = self.__parseJSON(rawdata)
-				if not data and type(data) is APIListResult:
+		if state:
+			for param in state:
+				self.changeParam(param, state[param])
+		try:
+			while True:
+				data = False
+				while not data:
+					rawdata = self.__getRaw()
+					data = self.__parseJSON(rawdata)
+					if not data and type(data) is APIListResult:
+						break
+				if 'error' in data:
+					if self.iswrite and data['error']['code'] == 'blocked':
+						raise wiki.UserBlocked(data['error']['info'])
+					raise APIError(data['error']['code'], data['error']['info'])
+				yield data
+				if checkpoint is not None:
+					checkpoint.update(data.get('continue'))
+				if 'continue' not in data: 
 					break
-			if 'error' in data:
-				if self.iswrite and data['error']['code'] == 'blocked':
-					raise wiki.UserBlocked(data['error']['info'])
-				raise APIError(data['error']['code'], data['error']['info'])
-			yield data
-			if 'continue' not in data: 
-				break
-			else:
-				self.request = copy.deepcopy(reqcopy)
-				for param in data['continue']:
-					self.changeParam(param, data['continue'][param])
+				else:
+					self.request = copy.deepcopy(reqcopy)
+					for param in data['continue']:
+						self.changeParam(param, data['continue'][param])
+		finally:
+			# Also when the generator is stopped early, so no progress is lost
+			if checkpoint is not None:
+				checkpoint.save()
 
 	def __longQuery(self, initialdata):
 		"""For queries that require multiple requests"""
@@ -310,12 +333,232 @@ for queries requring multiple requests""", FutureWarning)
 				return False
 		return content
 		
+class QueryCheckpoint(object):
+	"""The progress of a query made with APIRequest.queryGen
+	
+	Records the parameters for the next request of the query, so it can
+	be continued later. To resume a query in a new process, make a
+	QueryCheckpoint with the same filename and pass it to queryGen for a
+	request with the same parameters.
+	
+	"""
+	# Parameters that can differ between runs of the same query
+	ignoredParams = ('continue', 'format', 'maxlag', 'assert')
+	
+	def __init__(self, filename=None, interval=60):
+		"""
+		filename - file to save the progress in, None to only keep it in memory,
+		if the file exists the progress is loaded from it
+		interval - minimum number of seconds between saves, the progress is
+		always saved when the query finishes or the generator is stopped
+		"""
+		self.filename = filename
+		self.interval = interval
+		self.params = None # The parameters of the query
+		self.state = None # Continue parameters for the next request
+		self.count = 0 # Number of sets of results done
+		self.done = False
+		self.lastsave = time.time()
+		self.changed = False
+		if filename is not None and os.path.exists(filename):
+			f = open(filename, 'rb')
+			try:
+				self.load(json.loads(f.read()))
+			finally:
+				f.close()
+	
+	def start(self, params):
+		"""Called by queryGen when starting, returns the continue parameters
+		to start from, or None to start at the beginning
+		
+		params - the parameters of the query
+		
+		"""
+		params = self.__queryParams(params)
+		if self.params is None:
+			self.params = params
+		elif self.params != params:
+			raise APIError("Checkpoint is for a different query")
+		return self.state
+	
+	def update(self, state):
+		"""Called by queryGen after a set of results is used
+		
+		state - the continue parameters from the results, None if the query is done
+		
+		"""
+		self.count += 1
+		self.state = state
+		if not state:
+			self.done = True
+			self.state = None
+		self.changed = True
+		if self.done or time.time() - self.lastsave >= self.interval:
+			self.save()
+	
+	def save(self):
+		"""Save the progress to the file, if there is one and it changed"""
+		if self.filename is None or not self.changed:
+			return
+		# Write to a temporary file first so a failed write doesn't lose the old progress
+		tmpname = self.filename+'.tmp'
+		f = open(tmpname, 'wb')
+		try:
+			f.write(json.dumps(self.dump()))
+		finally:
+			f.close()
+		if os.name == 'nt' and os.path.exists(self.filename):
+			os.remove(self.filename)
+		os.rename(tmpname, self.filename)
+		self.lastsave = time.time()
+		self.changed = False
+	
+	def remove(self):
+		"""Delete the file, e.g. after the results of a finished query were saved"""
+		if self.filename is not None and os.path.exists(self.filename):
+			os.remove(self.filename)
+	
+	def dump(self):
+		"""Get the progress as a dict that can be saved as JSON"""
+		return {'params':self.params, 'state':self.state, 'count':self.count, 'done':self.done}
+	
+	def load(self, data):
+		"""Set the progress from a dict made by dump()"""
+		self.params = data['params']
+		self.state = data['state']
+		self.count = data['count']
+		self.done = data['done']
+	
+	def __queryParams(self, params):
+		ret = {}
+		for key in params:
+			if key in self.ignoredParams or key.endswith('continue'):
+				continue
+			value = params[key]
+			if not isinstance(value, basestring):
+				value = str(value)
+			if not isinstance(value, unicode):
+				value = unicode(value, 'utf8')
+			ret[unicode(key)] = value
+		return ret
+	
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+str(self.count)+" sets of results done>"
+
 class APIResult(dict):
 	response = []
 	
 class APIListResult(list):
 	response = []
-		
+
+def threadedGen(func, jobs, workers=1):
+	"""Run func over a list of jobs using a pool of threads
+	
+	func - a function taking a single job and returning an iterable of results
+	jobs - list of jobs
+	workers - number of threads to use, with 1 (the default) everything is
+	done in the calling thread
+	
+	Results are yielded as they arrive, so results from different jobs
+	may be interleaved in any order. If func raises an exception, it is
+	re-raised here and the remaining jobs are abandoned.
+	
+	"""
+	if workers <= 1 or len(jobs) <= 1:
+		for job in jobs:
+			for result in func(job):
+				yield result
+		return
+	jobqueue = Queue.Queue()
+	for job in jobs:
+		jobqueue.put(job)
+	# Bounded, so workers don't get too far ahead of the caller
+	results = Queue.Queue(workers*2)
+	stop = threading.Event()
+	def put(item):
+		while not stop.isSet():
+			try:
+				results.put(item, True, 0.5)
+				return True
+			except Queue.Full:
+				pass
+		return False
+	def worker():
+		try:
+			while not stop.isSet():
+				try:
+					job = jobqueue.get_nowait()
+				except Queue.Empty:
+					break
+				for result in func(job):
+					if not put((True, result)):
+						return
+		except Exception:
+			put((False, sys.exc_info()))
+		finally:
+			put((None, None))
+	threads = []
+	for x in range(min(workers, len(jobs))):
+		t = threading.Thread(target=worker)
+		t.setDaemon(True)
+		t.start()
+		threads.append(t)
+	running = len(threads)
+	try:
+		while running:
+			(ok, result) = results.get()
+			if ok is None:
+				running -= 1
+			elif ok:
+				yield result
+			else:
+				raise result[0], result[1], result[2]
+	finally:
+		stop.set()
+
+def prefetchGen(gen):
+	"""Run a generator in a background thread, one item ahead of the caller
+
+	gen - any iterable, typically a generator that does one request per item
+
+	While the caller processes an item, the next one is already being
+	retrieved. Exceptions are re-raised in the caller.
+
+	"""
+	results = Queue.Queue(1)
+	stop = threading.Event()
+	def put(item):
+		while not stop.isSet():
+			try:
+				results.put(item, True, 0.5)
+				return True
+			except Queue.Full:
+				pass
+		return False
+	def worker():
+		try:
+			for item in gen:
+				if not put((True, item)):
+					return
+		except Exception:
+			put((False, sys.exc_info()))
+		finally:
+			put((None, None))
+	t = threading.Thread(target=worker)
+	t.setDaemon(True)
+	t.start()
+	try:
+		while True:
+			(ok, item) = results.get()
+			if ok is None:
+				break
+			elif ok:
+				yield item
+			else:
+				raise item[0], item[1], item[2]
+	finally:
+		stop.set()
+
 def resultCombine(type, old, new):
 	"""Experimental-ish result-combiner thing
 	
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Copyright 2008-2013 Alex Zaddach (mrzmanwiki@gmail.com)
+
+# This file is part of wikitools.
+# wikitools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# wikitools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with wikitools.  If not, see <http://www.gnu.org/licenses/>.
+
+import api
+import page
+import socket
+import binascii
+import bisect
+import datetime
+import time
+
+def parseIP(ip):
+	"""Convert an IP address or CIDR range to integers
+
+	ip - an IPv4 or IPv6 address, optionally with a /bits suffix
+
+	Returns a tuple of (family, first address, last address), with family
+	4 or 6, or None if ip isn't an IP address or range
+
+	"""
+	ip = ip.strip()
+	bits = None
+	if '/' in ip:
+		(ip, bits) = ip.split('/', 1)
+		try:
+			bits = int(bits)
+		except ValueError:
+			return None
+	try:
+		if ':' in ip:
+			(family, size) = (6, 128)
+			packed = socket.inet_pton(socket.AF_INET6, ip)
+		else:
+			(family, size) = (4, 32)
+			if len(ip.split('.')) != 4:
+				return None # inet_aton allows shortened forms
+			packed = socket.inet_aton(ip)
+	except (socket.error, UnicodeError, ValueError):
+		return None
+	value = int(binascii.hexlify(packed), 16)
+	if bits is None:
+		return (family, value, value)
+	if bits < 0 or bits > size:
+		return None
+	hostmask = (1 << (size - bits)) - 1
+	start = value & ~hostmask
+	return (family, start, start | hostmask)
+
+class BlockIndex(object):
+	"""A local copy of the blocks on a wiki, for checking many users at once
+
+	Load it with load(), then isBlocked and getBlocks work without any
+	requests. update() gets the changes since the last load or update.
+	IP addresses are checked against range blocks as well.
+
+	"""
+	def __init__(self, site):
+		"""
+		site - A wiki object
+		"""
+		self.site = site
+		self.blocks = {} # block id -> block info from list=blocks
+		self.lastupdate = None # Time of the last load or update
+		self.names = {}
+		self.ranges = {4:([], [], [], []), 6:([], [], [], [])}
+		self.dirty = False
+
+	def load(self):
+		"""Load all current blocks, replacing any that were loaded before"""
+		self.lastupdate = time.time()
+		self.blocks = {}
+		params = self.__params()
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
+			for block in data['query']['blocks']:
+				self.__add(block)
+		self.dirty = True
+		return self
+
+	def update(self, overlap=300):
+		"""Get the blocks and unblocks since the last load or update
+
+		overlap - number of seconds before the last update to start
+		from, to allow for replication lag
+
+		New blocks and changed blocks come from list=blocks, unblocks from
+		the block log. Expired blocks are removed.
+
+		"""
+		if self.lastupdate is None:
+			return self.load()
+		start = page.apiTimestamp(datetime.datetime.utcfromtimestamp(self.lastupdate - overlap))
+		self.lastupdate = time.time()
+		params = {'action':'query',
+			'list':'logevents',
+			'letype':'block',
+			'lestart':start,
+			'ledir':'newer',
+			'leprop':'title|timestamp|type',
+			'lelimit':self.site.limit
+		}
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
+			for event in data['query']['logevents']:
+				if event.get('action') == 'unblock' and 'title' in event:
+					self.__removeTarget(event['title'].split(':', 1)[-1], event['timestamp'])
+		params = self.__params()
+		params['bkstart'] = start
+		params['bkdir'] = 'newer'
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
+			for block in data['query']['blocks']:
+				self.__add(block)
+		now = page.apiTimestamp(datetime.datetime.utcnow())
+		for (blockid, block) in self.blocks.items():
+			if not self.__active(block, now):
+				del self.blocks[blockid]
+		self.dirty = True
+		return self
+
+	def getBlocks(self, name):
+		"""Get the blocks that apply to a username or IP address
+
+		For IP addresses, this includes range blocks containing the address.
+		Returns a list of block info dicts from list=blocks.
+
+		"""
+		if self.dirty:
+			self.__build()
+		now = page.apiTimestamp(datetime.datetime.utcnow())
+		ip = parseIP(name)
+		if ip is None:
+			found = self.names.get(self.__nameKey(name), [])
+		else:
+			found = self.__findRanges(ip)
+		return [block for block in found if self.__active(block, now)]
+
+	def isBlocked(self, name):
+		"""Is a username or IP address blocked?"""
+		return len(self.getBlocks(name)) > 0
+
+	def __params(self):
+		return {'action':'query',
+			'list':'blocks',
+			'bkprop':'id|user|userid|by|timestamp|expiry|reason|range|flags',
+			'bklimit':self.site.limit
+		}
+
+	def __add(self, block):
+		if 'user' not in block:
+			return # Autoblocks don't say what they block
+		self.blocks[block['id']] = block
+
+	def __removeTarget(self, target, timestamp):
+		ip = parseIP(target)
+		key = self.__nameKey(target)
+		for (blockid, block) in self.blocks.items():
+			# A block made after the unblock still applies
+			if block.get('timestamp', '') > timestamp:
+				continue
+			if ip is None:
+				if self.__nameKey(block['user']) == key:
+					del self.blocks[blockid]
+			elif parseIP(block['user']) == ip:
+				del self.blocks[blockid]
+
+	def __active(self, block, now):
+		expiry = block.get('expiry', 'infinity')
+		return expiry in ('infinity', 'infinite', 'indefinite') or expiry > now
+
+	def __nameKey(self, name):
+		name = name.replace('_', ' ').strip()
+		return name[:1].upper() + name[1:]
+
+	def __build(self):
+		# Names are looked up in a dict. IP ranges are CIDR ranges, so any
+		# two are either nested or separate. They are sorted by start, and
+		# each one links to the smallest range that contains it, so the
+		# ranges containing an address are the one found with bisect and
+		# the chain of ranges containing that one.
+		self.names = {}
+		ranges = {4:[], 6:[]}
+		for block in self.blocks.values():
+			ip = parseIP(block['user'])
+			if ip is None:
+				self.names.setdefault(self.__nameKey(block['user']), []).append(block)
+			else:
+				ranges[ip[0]].append((ip[1], -ip[2], block))
+		for family in ranges:
+			items = ranges[family]
+			items.sort(key=lambda item: (item[0], item[1]))
+			starts = [item[0] for item in items]
+			ends = [-item[1] for item in items]
+			blocks = [item[2] for item in items]
+			parents = []
+			stack = []
+			for (index, start) in enumerate(starts):
+				while stack and ends[stack[-1]] < start:
+					stack.pop()
+				if stack:
+					parents.append(stack[-1])
+				else:
+					parents.append(-1)
+				stack.append(index)
+			self.ranges[family] = (starts, ends, blocks, parents)
+		self.dirty = False
+
+	def __findRanges(self, ip):
+		(family, first, last) = ip
+		(starts, ends, blocks, parents) = self.ranges[family]
+		found = []
+		index = bisect.bisect_right(starts, first) - 1
+		while index >= 0:
+			if ends[index] >= last:
+				found.append(blocks[index])
+			index = parents[index]
+		return found
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+str(len(self.blocks))+" blocks on "+repr(self.site.apibase)+">"
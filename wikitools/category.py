@@ -18,10 +18,19 @@
 import wiki
 import page
 import api
+import threading
+import os
+import gzip
+import time
+import datetime
+try:
+	import json
+except:
+	import simplejson as json
 
 class Category(page.Page):
 	"""A category on the wiki"""
-	def __init__(self, site, title=False, check=True, followRedir=False, section=False, sectionnumber=False, pageid=False):
+	def __init__(self, site, title=False, check=True, followRedir=False, section=False, sectionnumber=None, pageid=False):
 		"""	
 		wiki - A wiki object
 		title - The page title, as a string or unicode object
@@ -32,84 +41,446 @@ class Category(page.Page):
 		pageid - pageid, can be in place of title
 		""" 
 		page.Page.__init__(self, site=site, title=title, check=check, followRedir=followRedir, section=section, sectionnumber=sectionnumber, pageid=pageid)
-		self.members = []
+		self.members = page.PageIndex()
+		self.categoryinfo = {} # Member counts, see getCounts
 		if self.namespace != 14:
 			self.setNamespace(14, check)
 			
-	def getAllMembers(self, titleonly=False, reload=False, namespaces=False):
+	def getAllMembers(self, titleonly=False, reload=False, namespaces=False, refonly=False):
 		"""Gets a list of pages in the category
 		
 		titleonly - set to True to only create a list of strings,
 		else it will be a list of Page objects
 		reload - reload the list even if it was generated before
-		namespaces - List of namespaces to restrict to (queries with this option will not be cached)
+		namespaces - List of namespaces to restrict to
+		refonly - set to True to create a list of page.PageRef objects, which use
+		much less memory than Page objects (queries with this option will not be cached)
+		
+		Page objects are cached in self.members, a page.PageIndex, separately for
+		each namespace, so only namespaces that weren't loaded before are queried.
 		
 		"""
-		if self.members and not reload:
-			if titleonly:
-				if namespaces is not False:
-					return [p.title for p in self.members if p.namespace in namespaces]
-				else:
-					return [p.title for p in self.members]
-			if namespaces is False:
-				return self.members
-			else:
-				return [p for p in self.members if p.namespace in namespaces]
-		else:
-			ret = []
-			members = []
-			for member in self.__getMembersInternal(namespaces):
-				members.append(member)
-				if titleonly:
-					ret.append(member.title)
-			if titleonly:
-				return ret
-			if namespaces is False:
-				self.members = members
-			return members
+		members = list(self.getAllMembersGen(titleonly, reload, namespaces, refonly))
+		if namespaces is False and not titleonly and not refonly:
+			return self.members
+		return members
 	
-	def getAllMembersGen(self, titleonly=False, reload=False, namespaces=False):
+	def getAllMembersGen(self, titleonly=False, reload=False, namespaces=False, refonly=False):
 		"""Generator function for pages in the category
 		
 		titleonly - set to True to return strings,
 		else it will return Page objects
 		reload - reload the list even if it was generated before
-		namespaces - List of namespaces to restrict to (queries with this option will not be cached)
+		namespaces - List of namespaces to restrict to
+		refonly - set to True to return page.PageRef objects, which use
+		much less memory than Page objects (queries with this option will not be cached)
 		
 		"""
-		if self.members and not reload:
-			for member in self.members:
-				if namespaces is False or member.namespace in namespaces:
-					if titleonly:
-						yield member.title
-					else:
-						yield member
-		else:
-			if namespaces is False:
-				self.members = []
+		if reload:
+			self.members.clear()
+		if refonly or (titleonly and not self.members.covers(namespaces)):
 			for member in self.__getMembersInternal(namespaces):
-				if namespaces is False:
-					self.members.append(member)
 				if titleonly:
 					yield member.title
 				else:
 					yield member
+			return
+		for member in self.members.fill(namespaces, self.__getMembersInternal):
+			if titleonly:
+				yield member.title
+			else:
+				yield member
+	
+	def __contains__(self, item):
+		"""Is a page in the category? Loads all the members if they aren't already
+		
+		item - a Page or PageRef object or a title
+		
+		"""
+		if isinstance(item, basestring):
+			try:
+				item = page.normalizeTitle(item, self.site)[0]
+			except page.BadTitle:
+				return False
+		if not self.members.covers():
+			for member in self.getAllMembersGen():
+				pass
+		return item in self.members
 				
 	def __getMembersInternal(self, namespaces=False):
 		params = {'action':'query',
 			'list':'categorymembers',
 			'cmtitle':self.title,
 			'cmlimit':self.site.limit,
-			'cmprop':'title'
+			'cmprop':'ids|title'
 		}
 		if namespaces is not False:
 			params['cmnamespace'] = '|'.join([str(ns) for ns in namespaces])
-		while True:
-			req = api.APIRequest(self.site, params)
-			data = req.query(False)
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
 			for item in data['query']['categorymembers']:
-				yield page.Page(self.site, item['title'], check=False, followRedir=False)
+				yield page.PageRef(self.site, item['title'], item['pageid'], item['ns'])
+
+	def iterMembers(self, namespaces=False, content=False, categoryinfo=False, sortinfo=False, sort='sortkey', reverse=False, start=None, end=None):
+		"""Generator for the pages in the category, with their page info
+		
+		namespaces - List of namespaces to restrict to
+		content - also load the current wikitext of the pages
+		categoryinfo - also load the number of members of subcategories,
+		stored as the categoryinfo attribute of the Category objects
+		sortinfo - instead of the page info, get the sort key and the time
+		the page was added to the category, stored as the memberinfo
+		attribute of the pages. The API only returns these for
+		list=categorymembers, so content and categoryinfo can't be used with it
+		sort - 'sortkey' or 'timestamp', the order the API goes through the category
+		reverse - go through the category in reverse order
+		start, end - with sort='timestamp', only get pages added between these
+		times, as datetime objects or API timestamps
+		
+		Uses generator=categorymembers, so the pageid, namespace, lastrevid and
+		touched values of the pages come back with the list and each request
+		gets as many members as the API allows. Yields Page objects (Category and
+		File objects for subcategories and files) as each batch of results
+		arrives, within a batch they are not necessarily in the category's order.
+		
+		"""
+		if sortinfo and (content or categoryinfo):
+			raise wiki.WikiError("sortinfo can't be used with content or categoryinfo")
+		prefix = 'gcm'
+		if sortinfo:
+			prefix = 'cm'
+		params = {'action':'query'}
+		params[prefix+'title'] = self.title
+		params[prefix+'limit'] = self.site.limit
+		params[prefix+'sort'] = sort
+		if reverse:
+			params[prefix+'dir'] = 'desc'
+		if start is not None:
+			params[prefix+'start'] = page.apiTimestamp(start)
+		if end is not None:
+			params[prefix+'end'] = page.apiTimestamp(end)
+		if namespaces is not False:
+			params[prefix+'namespace'] = '|'.join([str(ns) for ns in namespaces])
+		if sortinfo:
+			params['list'] = 'categorymembers'
+			params['cmprop'] = 'ids|title|sortkey|sortkeyprefix|timestamp|type'
+			req = api.APIRequest(self.site, params)
+			for data in req.queryGen():
+				for item in data['query']['categorymembers']:
+					member = page.PageRef(self.site, item['title'], item['pageid'], item['ns']).toPage()
+					member.memberinfo = dict([(key, item[key]) for key in ('sortkey', 'sortkeyprefix', 'timestamp', 'type') if key in item])
+					yield member
+			return
+		params['generator'] = 'categorymembers'
+		prop = ['info']
+		if content:
+			prop.append('revisions')
+			params['rvprop'] = 'content|timestamp|ids|sha1'
+			# Content is limited to fewer pages per request
+			params['gcmlimit'] = int(self.site.limit)/10
+		if categoryinfo:
+			prop.append('categoryinfo')
+		params['prop'] = '|'.join(prop)
+		req = api.APIRequest(self.site, params)
+		batch = {}
+		for data in req.queryGen():
+			# The page data for one batch of members can be split over several
+			# responses, the batch is complete when batchcomplete is set
+			for (key, obj) in data.get('query', {}).get('pages', {}).items():
+				if key in batch:
+					obj = dict(obj)
+					obj['revisions'] = batch[key].get('revisions', []) + obj.get('revisions', [])
+					batch[key].update(obj)
+				else:
+					batch[key] = obj
+			if 'batchcomplete' not in data and 'continue' in data:
+				continue
+			for (key, obj) in batch.items():
+				yield self.__makeMember(key, obj, content, categoryinfo)
+			batch = {}
+
+	def __makeMember(self, key, obj, content, categoryinfo):
+		member = page.getPage(self.site, title=obj['title'], pageid=obj.get('pageid', False))
+		member._setFromQuery(key, obj, ['info'])
+		if categoryinfo and isinstance(member, Category):
+			member._setCounts(obj.get('categoryinfo'))
+		if content and obj.get('revisions'):
+			rev = obj['revisions'][0]
+			if '*' in rev:
+				member.wikitext = rev['*'].encode('utf-8')
+				member.lastedittime = rev['timestamp']
+				member.lastrevid = rev['revid']
+				if self.site.revcache is not None:
+					self.site.revcache.put(rev['revid'], member.wikitext, rev.get('sha1'))
+		return member
+
+	def getCounts(self, force=False):
+		"""Get the number of members of the category without listing them
+		
+		force - load the counts even if they were loaded before
+		
+		Returns a dict with the number of 'pages', 'subcats' and 'files' in
+		the category, and the total 'size'. See pagelist.getCategoryCounts
+		to get the counts of many categories at once.
+		
+		"""
+		if self.categoryinfo and not force:
+			return self.categoryinfo
+		import pagelist
+		pagelist.getCategoryCounts(self.site, [self])
+		return self.categoryinfo
+	
+	def _setCounts(self, info):
+		"""Set the member counts from the categoryinfo of a query result
+		
+		info - the categoryinfo, None if there wasn't one, which means
+		the category is empty
+		
+		"""
+		counts = {'size':0, 'pages':0, 'files':0, 'subcats':0}
+		if info:
+			for key in counts:
+				counts[key] = int(info.get(key, 0))
+		self.categoryinfo = counts
+		return counts
+	
+	def getAllMembersSharded(self, shards=None, workers=4, namespaces=False, refonly=False, checkpoint=None):
+		"""Generator for the pages in a large category, listed in parallel
+		
+		shards - number of sort key ranges to split the category into, by
+		default it's chosen from the size of the category (see getCounts)
+		workers - number of ranges to list at the same time
+		namespaces - List of namespaces to restrict to
+		refonly - set to True to return page.PageRef objects, which use
+		much less memory than Page objects
+		checkpoint - name of a file to save the progress in, so listing can
+		be resumed after being stopped, see pagelist.shardedQuery
+		
+		The category is split into ranges of sort key prefixes that are
+		listed concurrently, so the order of the pages is mixed. The
+		results are not cached.
+		
+		"""
+		import pagelist
+		if shards is None:
+			# Enough ranges that each one takes a few requests
+			size = self.getCounts()['size']
+			shards = size / (int(self.site.limit)*4) + 1
+		params = {'action':'query',
+			'list':'categorymembers',
+			'cmtitle':self.title,
+			'cmlimit':self.site.limit,
+			'cmprop':'ids|title'
+		}
+		if namespaces is not False:
+			params['cmnamespace'] = '|'.join([str(ns) for ns in namespaces])
+		for item in pagelist.shardedQuery(self.site, params, pagelist.makeShards(shards), workers, checkpoint):
+			member = page.PageRef(self.site, item['title'], item['pageid'], item['ns'])
+			if refonly:
+				yield member
+			else:
+				yield member.toPage()
+	
+	def walk(self, depth=None, namespaces=False, workers=1, maxrequests=None, refonly=False, counts=False):
+		"""Generator for the pages in the category and its subcategories
+		
+		depth - number of levels of subcategories to go into, 0 for only
+		this category, None (the default) for no limit
+		namespaces - List of namespaces of the pages to return, subcategories
+		are always listed so they can be walked
+		workers - number of categories to list concurrently
+		maxrequests - stop after this many requests, None for no limit
+		refonly - set to True to return page.PageRef objects, which use
+		much less memory than Page objects
+		counts - before listing each level, get the member counts of its
+		categories in batches (see getCounts). Categories that have nothing
+		to return are skipped and the largest ones are listed first.
+		This saves requests in trees with many empty categories.
+		
+		The tree is walked breadth-first, one level at a time, with the
+		categories of each level listed by a pool of workers. Each page and
+		category is returned once, even if it's in several categories or
+		the tree has cycles, and pages are returned as they are found.
+		This category itself is not returned.
+		
+		"""
+		visited = set([self.title])
+		seen = set([self.title])
+		counter = [0]
+		lock = threading.Lock()
+		def allowRequest():
+			if maxrequests is None:
+				return True
+			lock.acquire()
 			try:
-				params['cmcontinue'] = data['query-continue']['categorymembers']['cmcontinue']
-			except:
+				if counter[0] >= maxrequests:
+					return False
+				counter[0] += 1
+				return True
+			finally:
+				lock.release()
+		listns = namespaces
+		if namespaces is not False and 14 not in namespaces:
+			listns = list(namespaces) + [14]
+		def listCategory(title):
+			return self.__walkMembers(title, listns, allowRequest)
+		level = [self.title]
+		levelnum = 0
+		while level:
+			nextlevel = []
+			for member in api.threadedGen(listCategory, level, workers):
+				if member.title in seen:
+					continue
+				seen.add(member.title)
+				if member.namespace == 14 and member.title not in visited:
+					visited.add(member.title)
+					if depth is None or levelnum < depth:
+						nextlevel.append(member.title)
+				if namespaces is False or member.namespace in namespaces:
+					if refonly:
+						yield member
+					else:
+						yield member.toPage()
+			if counts and nextlevel:
+				nextlevel = self.__filterByCounts(nextlevel, namespaces, workers, counter)
+			level = nextlevel
+			levelnum += 1
+
+	def __filterByCounts(self, titles, namespaces, workers, counter):
+		import pagelist
+		batch = int(self.site.limit)/10
+		counter[0] += (len(titles) + batch - 1) / batch
+		allcounts = pagelist.getCategoryCounts(self.site, titles, batch, workers)
+		sizes = {}
+		for title in titles:
+			if title not in allcounts:
+				sizes[title] = 0 # Unknown, so list it anyway
+				continue
+			info = allcounts[title]
+			wanted = info['subcats']
+			if namespaces is False:
+				wanted = info['size']
+			else:
+				if 6 in namespaces:
+					wanted += info['files']
+				if [ns for ns in namespaces if ns not in (6, 14)]:
+					wanted += info['pages']
+			if wanted:
+				sizes[title] = info['size']
+		ret = sizes.keys()
+		ret.sort(key=lambda title: sizes[title], reverse=True)
+		return ret
+
+	def __walkMembers(self, title, namespaces, allowRequest):
+		params = {'action':'query',
+			'list':'categorymembers',
+			'cmtitle':title,
+			'cmlimit':self.site.limit,
+			'cmprop':'ids|title'
+		}
+		if namespaces is not False:
+			params['cmnamespace'] = '|'.join([str(ns) for ns in namespaces])
+		req = api.APIRequest(self.site, params)
+		results = req.queryGen()
+		while allowRequest():
+			data = results.next()
+			for item in data['query']['categorymembers']:
+				yield page.PageRef(self.site, item['title'], item['pageid'], item['ns'])
+			if 'continue' not in data:
 				break 
+
+	def updateSnapshot(self, filename, reconcile=7*24*3600, overlap=3600, full=False):
+		"""Update a snapshot of the category members stored in a file
+		
+		filename - the file to store the snapshot in, as gzipped JSON
+		reconcile - number of seconds after which the full list of members
+		is loaded again, to find pages removed from the category
+		overlap - number of seconds before the last update to start looking
+		for new members from, to allow for replication lag
+		full - load the full list of members now
+		
+		The first time, the full list of members is loaded. After that, only
+		pages added since the last update are listed, using cmsort=timestamp,
+		which usually takes a single request. Removed pages can only be found
+		by loading the full list, which is done when the last full load is
+		older than reconcile seconds.
+		Returns a tuple of lists of page.PageRef objects (added, removed),
+		all members are added the first time.
+		
+		"""
+		snapshot = self.__readSnapshot(filename)
+		now = time.time()
+		if snapshot is None:
+			snapshot = {'title':self.title, 'members':{}, 'lastfull':0}
+			full = True
+		elif now - snapshot['lastfull'] > reconcile:
+			full = True
+		params = {'action':'query',
+			'list':'categorymembers',
+			'cmtitle':self.title,
+			'cmlimit':self.site.limit,
+			'cmprop':'ids|title|timestamp'
+		}
+		if not full:
+			start = datetime.datetime.utcfromtimestamp(snapshot['lastupdate'] - overlap)
+			params['cmsort'] = 'timestamp'
+			params['cmstart'] = page.apiTimestamp(start)
+		found = {}
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
+			for item in data['query']['categorymembers']:
+				found[item['title']] = [item['pageid'], item['ns'], item.get('timestamp')]
+		members = snapshot['members']
+		added = [title for title in found if title not in members]
+		if full:
+			removed = [title for title in members if title not in found]
+			removedrefs = [page.PageRef(self.site, title, members[title][0], members[title][1]) for title in removed]
+			members = found
+			snapshot['lastfull'] = now
+		else:
+			removedrefs = []
+			members.update(found)
+		snapshot['members'] = members
+		snapshot['lastupdate'] = now
+		self.__writeSnapshot(filename, snapshot)
+		addedrefs = [page.PageRef(self.site, title, found[title][0], found[title][1]) for title in added]
+		return (addedrefs, removedrefs)
+	
+	def loadSnapshot(self, filename):
+		"""Get the members of the category from a snapshot made by updateSnapshot
+		
+		Returns a list of page.PageRef objects, or None if there is no snapshot
+		
+		"""
+		snapshot = self.__readSnapshot(filename)
+		if snapshot is None:
+			return None
+		members = snapshot['members']
+		return [page.PageRef(self.site, title, members[title][0], members[title][1]) for title in members]
+	
+	def __readSnapshot(self, filename):
+		if not os.path.exists(filename):
+			return None
+		f = gzip.open(filename, 'rb')
+		try:
+			snapshot = json.loads(f.read())
+		finally:
+			f.close()
+		title = self.title
+		if not isinstance(title, unicode):
+			title = unicode(title, 'utf8')
+		if snapshot.get('title') != title:
+			raise wiki.WikiError("Snapshot file is for "+repr(snapshot.get('title'))+", not "+repr(self.title))
+		return snapshot
+	
+	def __writeSnapshot(self, filename, snapshot):
+		# Write to a temporary file first so a failed write doesn't lose the old snapshot
+		tmpname = filename+'.tmp'
+		f = gzip.open(tmpname, 'wb')
+		try:
+			f.write(json.dumps(snapshot, separators=(',', ':')))
+		finally:
+			f.close()
+		if os.name == 'nt' and os.path.exists(filename):
+			os.remove(filename)
+		os.rename(tmpname, filename)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright 2008-2013 Alex Zaddach (mrzmanwiki@gmail.com)
+
+# This file is part of wikitools.
+# wikitools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# wikitools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with wikitools.  If not, see <http://www.gnu.org/licenses/>.
+
+import wiki
+import api
+import page
+import time
+import threading
+
+class EditQueue(object):
+	"""A queue of edits to be made concurrently within a rate limit"""
+	def __init__(self, site, workers=1, rate=None, maxretries=3, **editargs):
+		"""
+		site - A wiki object
+		workers - number of edits to make at the same time
+		rate - maximum number of edits per minute, None for no limit
+		maxretries - number of times to retry an edit after an edit conflict,
+		only for edits made with a transform function
+		editargs - arguments passed to Page.edit for every edit, e.g. summary or bot
+		"""
+		self.site = site
+		self.workers = workers
+		self.rate = rate
+		self.maxretries = maxretries
+		self.editargs = editargs
+		self.jobs = []
+		self.lock = threading.Lock()
+		self.nextedit = 0
+
+	def add(self, editpage, text=None, transform=None, **kwargs):
+		"""Add an edit to the queue
+
+		editpage - the Page object to edit
+		text - the new text of the page
+		transform - instead of text, a function that takes the current text
+		of the page and returns the new text. If it returns None or the
+		text is unchanged, the page is not edited. On an edit conflict,
+		the text is loaded again and the function is called again.
+		kwargs - arguments passed to Page.edit for this edit only
+
+		"""
+		if (text is None) == (transform is None):
+			raise page.EditError("Must give either text or transform")
+		self.jobs.append((editpage, text, transform, kwargs))
+
+	def run(self):
+		"""Make the edits in the queue
+
+		Generator that yields (page, result) tuples as each edit is done.
+		result is the API result of the edit, None if the transform function
+		made no change, or the exception raised while trying to edit,
+		including exceptions raised by the transform function.
+		wiki.UserBlocked is not caught, as no more edits can be made.
+
+		"""
+		jobs = self.jobs
+		self.jobs = []
+		# Get the token once now so the workers don't all request it
+		self.site.getToken('csrf')
+		return api.threadedGen(self.__doEdit, jobs, self.workers)
+
+	def __doEdit(self, job):
+		(editpage, text, transform, kwargs) = job
+		attempt = 0
+		while True:
+			args = self.editargs.copy()
+			args.update(kwargs)
+			try:
+				if transform is not None:
+					oldtext = editpage.getWikiText(force=attempt > 0)
+					text = transform(oldtext)
+					if text is None or text == oldtext:
+						yield (editpage, None)
+						return
+					args['basetimestamp'] = editpage.lastedittime
+				args['text'] = text
+				self.__wait()
+				result = editpage.edit(**args)
+			except wiki.UserBlocked:
+				raise
+			except api.APIError, exc:
+				if exc.args[0] == 'editconflict' and transform is not None and attempt < self.maxretries:
+					attempt += 1
+					continue
+				yield (editpage, exc)
+				return
+			except Exception, exc:
+				# Including errors from the transform function or the network,
+				# so the other edits in the queue are still made
+				yield (editpage, exc)
+				return
+			yield (editpage, result)
+			return
+
+	def __wait(self):
+		if not self.rate:
+			return
+		self.lock.acquire()
+		try:
+			now = time.time()
+			wait = self.nextedit - now
+			self.nextedit = max(now, self.nextedit) + 60.0/self.rate
+		finally:
+			self.lock.release()
+		if wait > 0:
+			time.sleep(wait)
+
+	def __len__(self):
+		return len(self.jobs)
+
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+str(len(self.jobs))+" edits for "+repr(self.site.apibase)+">"
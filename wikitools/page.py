@@ -22,6 +22,7 @@ import urllib
 import re
 from hashlib import md5
 import unicodedata
+import threading
 
 
 class BadTitle(wiki.WikiError):
@@ -57,8 +58,498 @@ def namespaceDetect(title, site):
 				for ns in site.NSaliases:
 					if nsprefix == ns.lower():
 						return int(site.NSaliases[ns])
-	return 0	
-	
+	return 0
+
+# Characters MediaWiki treats as spaces in titles, and bidi marks it removes
+titleSpaceRE = re.compile(u'[ _\xa0\u1680\u180e\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+')
+titleStripRE = re.compile(u'[\u200e\u200f\u202a-\u202e]')
+titleBadRE = re.compile(u'%[0-9A-Fa-f]{2}|&[A-Za-z0-9\x80-\xff]+;|(^|/)\\.\\.?(/|$)|~{3}')
+
+def namespaceIndex(site):
+	"""Get a dict of lowercase namespace names and aliases to namespace numbers
+
+	Built from the siteinfo the first time it's needed and stored as site.nsindex
+
+	"""
+	if site.nsindex:
+		return site.nsindex
+	index = {}
+	for ns in site.namespaces:
+		nsinfo = site.namespaces[ns]
+		for key in ('*', 'canonical'):
+			if nsinfo.get(key):
+				index[nsinfo[key].lower()] = int(ns)
+	for alias in site.NSaliases:
+		index[alias.lower()] = int(site.NSaliases[alias])
+	site.nsindex = index
+	return index
+
+def normalizeTitle(title, site, namespace=0):
+	"""Normalize a title the same way MediaWiki does, without using the API
+
+	title - the page title, as a string or unicode object
+	site - the wiki object the page is on, its siteinfo is used for the
+	namespace names and aliases, capitalization rules and legal characters
+	namespace - the namespace to use if the title has no namespace prefix
+
+	Handles underscores and whitespace, unicode normalization, namespace
+	prefixes and aliases, first letter capitalization and section fragments.
+	Interwiki prefixes are not recognized.
+	Returns a tuple of (title, namespace number), the title is a unicode
+	object, raises BadTitle for titles MediaWiki would consider invalid.
+
+	"""
+	if not isinstance(title, unicode):
+		title = unicode(title, 'utf8')
+	orig = title
+	title = unicodedata.normalize('NFC', title)
+	title = titleStripRE.sub(u'', title)
+	title = titleSpaceRE.sub(u' ', title).strip()
+	if title.startswith(u':'):
+		title = title[1:].lstrip()
+		namespace = 0
+	ns = int(namespace)
+	if u':' in title and site.namespaces:
+		(prefix, rest) = title.split(u':', 1)
+		index = namespaceIndex(site)
+		if prefix.strip().lower() in index:
+			ns = index[prefix.strip().lower()]
+			title = rest.lstrip()
+	if u'#' in title:
+		title = title.split(u'#', 1)[0].rstrip()
+	if not title:
+		raise BadTitle(orig)
+	legal = site.siteinfo.get('legaltitlechars')
+	if legal:
+		# legaltitlechars is for UTF-8 bytes, so any non-ASCII character is allowed
+		ascii = re.sub(u'[^\x00-\x7f]', u'', title)
+		if re.search(u'[^%s]' % legal, ascii):
+			raise BadTitle(orig)
+	if titleBadRE.search(title) or title.startswith(u':'):
+		raise BadTitle(orig)
+	if ns in site.namespaces:
+		case = site.namespaces[ns].get('case', site.siteinfo.get('case', 'first-letter'))
+	else:
+		case = site.siteinfo.get('case', 'first-letter')
+	if case == 'first-letter':
+		title = title[0].upper() + title[1:]
+	if ns != 0 and ns in site.namespaces:
+		title = u':'.join((site.namespaces[ns]['*'], title))
+	return (title, ns)
+
+# Held while looking up or adding to a site's page registry
+_registryLock = threading.Lock()
+
+def getPage(site, title=False, pageid=False, check=False, followRedir=False):
+	"""Get a Page object for a page
+
+	Same arguments as the Page constructor. Returns a Category or File for
+	pages in those namespaces. If the site has a page registry (see
+	Wiki.setPageRegistry), an existing object for the same title or pageid
+	is returned if there is one, otherwise the new object is added to it.
+
+	"""
+	import category
+	import wikifile
+	registry = site.registry
+	ns = None
+	key = None
+	if title and site.namespaces:
+		try:
+			(key, ns) = normalizeTitle(title, site)
+		except BadTitle:
+			pass # Let the constructor deal with it
+	if registry is not None:
+		existing = None
+		_registryLock.acquire()
+		try:
+			if key is not None:
+				existing = registry.get(key)
+			elif pageid and int(pageid) > 0:
+				existing = registry.get(int(pageid))
+		finally:
+			_registryLock.release()
+		if existing is not None:
+			return existing
+	if ns == 14:
+		item = category.Category(site, title=title, check=check, followRedir=followRedir, pageid=pageid)
+	elif ns == 6:
+		item = wikifile.File(site, title=title, check=check, followRedir=followRedir, pageid=pageid)
+	else:
+		item = Page(site, title=title, check=check, followRedir=followRedir, pageid=pageid)
+	if registry is None:
+		return item
+	# The object isn't made while holding the lock, since that may need a
+	# request. If another thread added the same page meanwhile, use that one.
+	_registryLock.acquire()
+	try:
+		if item.title:
+			item = registry.setdefault(item.title, item)
+		if item.pageid > 0:
+			existing = registry.setdefault(item.pageid, item)
+			if existing is not item:
+				if item.title:
+					registry[item.title] = existing
+				item = existing
+	finally:
+		_registryLock.release()
+	return item
+
+def apiTimestamp(ts):
+	"""Convert a datetime object to the API's timestamp format
+
+	Strings are assumed to already be in an acceptable format and returned as-is
+
+	"""
+	if isinstance(ts, datetime.datetime):
+		return ts.strftime('%Y-%m-%dT%H:%M:%SZ')
+	return ts
+
+def findSections(text):
+	"""Find the section headings in wikitext
+
+	text - the wikitext of a page
+
+	Returns a list of dicts in the same format as Page.getSections.
+	Headings inside comments, nowiki, and pre tags are skipped.
+
+	"""
+	if not isinstance(text, unicode):
+		text = unicode(text, 'utf8')
+	text = stripIgnored(text)
+	sections = []
+	levels = []
+	counters = []
+	for line in text.split('\n'):
+		m = headingRE.match(line)
+		if not m:
+			continue
+		level = min(len(m.group(1)), len(m.group(3)), 6)
+		# Extra = signs on one side are part of the heading text
+		name = ('='*(len(m.group(1))-level) + m.group(2) + '='*(len(m.group(3))-level)).strip()
+		if not name:
+			continue
+		# Table of contents numbering, based on the relative heading levels
+		popped = None
+		while levels and levels[-1] > level:
+			levels.pop()
+			popped = counters.pop()
+		if levels and levels[-1] == level:
+			counters[-1] += 1
+		elif popped is not None:
+			# Between two existing levels, it's treated as the higher one
+			levels.append(level)
+			counters.append(popped+1)
+		else:
+			levels.append(level)
+			counters.append(1)
+		sections.append({
+			u'line': name,
+			u'anchor': name.replace(u' ', u'_'),
+			u'index': unicode(len(sections)+1),
+			u'level': unicode(level),
+			u'number': u'.'.join([unicode(c) for c in counters]),
+			u'toclevel': len(counters)
+		})
+	return sections
+
+headingRE = re.compile(r'^(=+)(.+?)(=+)[ \t]*$')
+ignoredRE = re.compile(r'<!--.*?(?:-->|$)|<(nowiki|pre|math|source|syntaxhighlight)(?:\s[^>]*)?>.*?(?:</\1\s*>|$)', re.S|re.I)
+
+def stripIgnored(text):
+	"""Remove comments and the contents of nowiki, pre, math, source and
+	syntaxhighlight tags from wikitext
+
+	Newlines are kept so line-based markup is not changed
+
+	"""
+	return ignoredRE.sub(lambda m: u'\n' * m.group(0).count(u'\n'), text)
+
+linkRE = re.compile(r'\[\[\s*([^\[\]\|\n{}<>]+?)\s*(?:\||\]\])')
+templateRE = re.compile(r'(?<!\{)\{\{(?!\{)\s*([^{}\|\n<>]+?)\s*(?:\||\}\})')
+# Variables and parser functions that look like templates
+magicWords = set(['!', '=', 'currentmonth', 'currentmonth1', 'currentmonthname', 'currentmonthnamegen',
+	'currentmonthabbrev', 'currentday', 'currentday2', 'currentdayname', 'currentyear', 'currenttime',
+	'currenthour', 'currentweek', 'currentdow', 'currenttimestamp', 'localmonth', 'localmonth1',
+	'localmonthname', 'localmonthnamegen', 'localmonthabbrev', 'localday', 'localday2', 'localdayname',
+	'localyear', 'localtime', 'localhour', 'localweek', 'localdow', 'localtimestamp', 'numberofarticles',
+	'numberoffiles', 'numberofusers', 'numberofactiveusers', 'numberofpages', 'numberofadmins',
+	'numberofedits', 'pagename', 'pagenamee', 'fullpagename', 'fullpagenamee', 'namespace', 'namespacee',
+	'namespacenumber', 'talkspace', 'talkspacee', 'subjectspace', 'subjectspacee', 'articlespace',
+	'articlespacee', 'subpagename', 'subpagenamee', 'basepagename', 'basepagenamee', 'rootpagename',
+	'rootpagenamee', 'talkpagename', 'talkpagenamee', 'subjectpagename', 'subjectpagenamee',
+	'articlepagename', 'articlepagenamee', 'revisionid', 'revisionday', 'revisionday2', 'revisionmonth',
+	'revisionmonth1', 'revisionyear', 'revisiontimestamp', 'revisionuser', 'revisionsize', 'pageid',
+	'sitename', 'server', 'servername', 'scriptpath', 'stylepath', 'contentlanguage', 'contentlang',
+	'directionmark', 'dirmark', 'currentversion', 'noexternallanglinks', 'defaultsort', 'defaultsortkey',
+	'defaultcategorysort', 'displaytitle', 'lc', 'uc', 'lcfirst', 'ucfirst', 'urlencode', 'anchorencode',
+	'localurl', 'localurle', 'fullurl', 'fullurle', 'canonicalurl', 'canonicalurle', 'filepath', 'ns',
+	'nse', 'formatnum', 'padleft', 'padright', 'plural', 'grammar', 'gender', 'int', 'special',
+	'speciale', 'tag', 'formatdate', 'dateformat', 'pagesincategory', 'pagesincat', 'pagesize',
+	'protectionlevel', 'protectionexpiry', 'numberingroup', 'numberinggroup', 'language', 'bidi',
+	'cascadingsources', 'pageswithprop', 'subst', 'safesubst'])
+
+def extractLinks(text, site, title=None):
+	"""Find the internal links in wikitext without using the API
+
+	text - the wikitext
+	site - the wiki object the page is on, used for namespace names
+	title - the title of the page, used for links to subpages
+
+	Returns a list of titles like Page.getLinks. This is an approximation,
+	links made by templates are not found and interwiki links are
+	treated as normal links.
+
+	"""
+	(links, images, categories) = _extractLinkTargets(text, site, title)
+	return _sortTitles(links)
+
+def extractCategories(text, site):
+	"""Find the categories in wikitext without using the API
+
+	Returns a list of titles like Page.getCategories. Categories added
+	by templates are not found.
+
+	"""
+	(links, images, categories) = _extractLinkTargets(text, site)
+	return _sortTitles(categories)
+
+def extractTemplates(text, site):
+	"""Find the templates used in wikitext without using the API
+
+	Returns a list of titles like Page.getTemplates. Only templates used
+	directly are found, not ones used by other templates.
+
+	"""
+	if not isinstance(text, unicode):
+		text = unicode(text, 'utf8')
+	text = stripIgnored(text)
+	templates = {}
+	for target in templateRE.findall(text):
+		if target.startswith(u'#'):
+			continue # Parser function
+		if u':' in target:
+			prefix = target.split(u':', 1)[0].strip().lower()
+			if prefix in ('msgnw', 'msg', 'raw'):
+				target = target.split(u':', 1)[1]
+			elif prefix in magicWords:
+				continue
+		elif target.lower() in magicWords:
+			continue
+		try:
+			(target, ns) = normalizeTitle(target, site, 10)
+		except BadTitle:
+			continue
+		if ns >= 0:
+			templates[target] = ns
+	return _sortTitles(templates)
+
+def _extractLinkTargets(text, site, title=None):
+	if not isinstance(text, unicode):
+		text = unicode(text, 'utf8')
+	text = stripIgnored(text)
+	links = {}
+	images = {}
+	categories = {}
+	for target in linkRE.findall(text):
+		colon = target.startswith(u':')
+		if target.startswith(u'/') and title:
+			target = title + target.rstrip(u'/')
+		try:
+			(target, ns) = normalizeTitle(target, site)
+		except BadTitle:
+			continue # Including links to sections of the same page
+		if ns == 14 and not colon:
+			categories[target] = ns
+		elif (ns == 6 and not colon) or ns == -2:
+			images[target] = ns
+		elif ns >= 0:
+			links[target] = ns
+	return (links, images, categories)
+
+def _sortTitles(titles):
+	# The API sorts by namespace, then title
+	return sorted(titles.keys(), key=lambda t: (titles[t], t))
+
+loadableProps = ('info', 'links', 'templates', 'categories', 'protection')
+
+def loadParams(site, props):
+	"""Make the API parameters to load several kinds of page data in one query
+
+	props - list of page data to load, any of loadableProps
+
+	"""
+	invalid = set(props).difference(loadableProps)
+	if invalid:
+		raise wiki.WikiError("Invalid props: "+', '.join(invalid))
+	prop = []
+	params = {'action':'query'}
+	if 'info' in props or 'protection' in props:
+		prop.append('info')
+	if 'protection' in props:
+		params['inprop'] = 'protection'
+	if 'links' in props:
+		prop.append('links')
+		params['pllimit'] = site.limit
+	if 'templates' in props:
+		prop.append('templates')
+		params['tllimit'] = site.limit
+	if 'categories' in props:
+		prop.append('categories')
+		params['cllimit'] = site.limit
+	params['prop'] = '|'.join(prop)
+	return params
+
+class PageRef(object):
+	"""A lightweight reference to a page on the wiki
+
+	Only stores the site, pageid, namespace and title, for working with
+	very large lists of pages. Use toPage() to get a full Page object.
+
+	"""
+	__slots__ = ('site', 'pageid', 'namespace', 'title')
+
+	def __init__(self, site, title, pageid=0, namespace=0):
+		"""
+		site - A wiki object
+		title - The full page title, as returned by the API
+		pageid - The pageid, 0 if unknown
+		namespace - The namespace number
+		"""
+		self.site = site
+		self.title = title
+		self.pageid = int(pageid)
+		self.namespace = int(namespace)
+
+	@property
+	def unprefixedtitle(self):
+		if self.namespace == 0:
+			return self.title
+		return self.title.split(':', 1)[1]
+
+	def toPage(self, check=False, followRedir=False):
+		"""Make a full Page object for the page
+
+		Returns a Category or File for pages in those namespaces, and
+		uses the site's page registry, see getPage
+		check and followRedir have the same meaning as in the Page constructor
+
+		"""
+		return getPage(self.site, title=self.title, pageid=self.pageid or False, check=check, followRedir=followRedir)
+
+	def __hash__(self):
+		return hash(self.title) ^ hash(self.site.apibase)
+
+	def __eq__(self, other):
+		if not isinstance(other, (PageRef, Page)):
+			return False
+		return self.title == other.title and self.site == other.site
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __str__(self):
+		return self.__class__.__name__ +' '+repr(self.title) + " from " + repr(self.site.domain)
+
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+repr(self.title)+" using "+repr(self.site.apibase)+">"
+
+class PageIndex(list):
+	"""A list of pages, also indexed by namespace and title
+
+	Used for the cached members of categories and usage of files. Pages
+	should only be added with append or extend, so the index is kept
+	up to date. Tests with "in" compare titles.
+
+	"""
+	def __init__(self, pages=()):
+		list.__init__(self)
+		self.bynamespace = {}
+		self.titles = {}
+		self.complete = False # All namespaces are loaded
+		self.loaded = set() # Namespaces that are completely loaded
+		self.extend(pages)
+
+	def append(self, item):
+		list.append(self, item)
+		self.bynamespace.setdefault(int(item.namespace), []).append(item)
+		self.titles[self.__key(item)] = item
+
+	def extend(self, items):
+		for item in items:
+			self.append(item)
+
+	def clear(self):
+		"""Remove all pages"""
+		del self[:]
+		self.bynamespace = {}
+		self.titles = {}
+		self.complete = False
+		self.loaded = set()
+
+	def covers(self, namespaces=False):
+		"""Are all the pages in namespaces loaded? False for all namespaces"""
+		if self.complete:
+			return True
+		if namespaces is False:
+			return False
+		for ns in namespaces:
+			if int(ns) not in self.loaded:
+				return False
+		return True
+
+	def filter(self, namespaces=False):
+		"""Get the pages in namespaces, False for all namespaces"""
+		if namespaces is False:
+			return list(self)
+		ret = []
+		for ns in namespaces:
+			ret.extend(self.bynamespace.get(int(ns), []))
+		return ret
+
+	def fill(self, namespaces, query):
+		"""Generator for the pages in namespaces, loading any that aren't loaded yet
+
+		namespaces - List of namespaces, False for all namespaces
+		query - function taking the same kind of namespaces argument and
+		returning PageRef objects for all the pages in them
+
+		New pages are only added to the index once all of them are loaded.
+
+		"""
+		if self.covers(namespaces):
+			for item in self.filter(namespaces):
+				yield item
+			return
+		if namespaces is False:
+			missing = False
+		else:
+			for item in self.filter([ns for ns in namespaces if self.covers([ns])]):
+				yield item
+			missing = [int(ns) for ns in namespaces if not self.covers([ns])]
+		new = []
+		for item in query(missing):
+			item = item.toPage()
+			new.append(item)
+			yield item
+		if missing is False:
+			self.clear()
+			self.extend(new)
+			self.complete = True
+		else:
+			self.extend(new)
+			self.loaded.update(missing)
+
+	def __key(self, item):
+		if isinstance(item, (Page, PageRef)):
+			item = item.title
+		if not isinstance(item, unicode):
+			item = unicode(item, 'utf8')
+		return item
+
+	def __contains__(self, item):
+		return self.__key(item) in self.titles
+
 class Page(object):
 	""" A page on the wiki"""
 
@@ -92,6 +583,11 @@ class Page(object):
 		self.exists = True # If we're not going to check, assume it does
 		self.protection = {}
 		self.namespace = namespace
+		self.lastrevid = 0 # Set when data is loaded, used by refresh()
+		self.touched = None
+		self.sectionindex = []
+		self.sectionsource = None # What sectionindex was made from, see getSections
+		self.lazygroup = None # See pagelist.PageGroup
 		
 		# Things that need to be done before anything else
 		if self.title:
@@ -102,7 +598,7 @@ class Page(object):
 			if self.title:
 				self.unprefixedtitle = self.title
 				self.title = ':'.join((self.site.namespaces[self.namespace]['*'], self.title.decode('utf8')))
-		if int(self.namespace) is 0 and self.title:
+		if self.namespace is not False and int(self.namespace) == 0 and self.title:
 			self.namespace = int(self.namespace)
 			self.unprefixedtitle = self.title		
 		# Setting page info with API, should set:
@@ -110,7 +606,16 @@ class Page(object):
 		if check:
 			self.setPageInfo()
 		else:
-			if self.namespace is False and self.title:
+			if self.title and self.site.namespaces:
+				# Normalize the title like the API would, see normalizeTitle
+				if self.namespace is False:
+					self.namespace = 0
+				(self.title, self.namespace) = normalizeTitle(self.title, self.site, self.namespace)
+				if self.namespace != 0:
+					self.unprefixedtitle = self.title.split(':', 1)[1]
+				else:
+					self.unprefixedtitle = self.title
+			elif self.namespace is False and self.title:
 				self.namespace = namespaceDetect(self.title, self.site)
 				if self.namespace is not 0:
 					nsname = self.site.namespaces[self.namespace]['*']
@@ -130,6 +635,40 @@ class Page(object):
 				self.unprefixedtitle = unicode(self.unprefixedtitle, 'utf-8')
 			self.urltitle = urllib.quote(self.title.encode('utf-8')).replace('%20', '_').replace('%2F', '/')
 
+	def __getWikitext(self):
+		group = self.__dict__.get('lazygroup')
+		if '_wikitext' not in self.__dict__ and group is not None:
+			group.load('wikitext', self)
+		store = self.site.textstore
+		if store is not None:
+			text = store.get(self)
+			if text is not None:
+				return text
+		return self.__dict__.get('_wikitext', '')
+
+	def __setWikitext(self, text):
+		store = self.site.textstore
+		if store is not None and text:
+			store.put(self, text)
+			self._wikitext = ''
+		else:
+			if store is not None:
+				store.discard(self)
+			self._wikitext = text
+
+	# Kept compressed when the site has a text store, see Wiki.setTextStore
+	wikitext = property(__getWikitext, __setWikitext)
+
+	def __getattr__(self, name):
+		# Only called for attributes that aren't set, which is the case for
+		# the ones waiting to be loaded by a pagelist.PageGroup
+		group = self.__dict__.get('lazygroup')
+		if group is not None and name in group.kinds:
+			group.load(name, self)
+			if name in self.__dict__:
+				return self.__dict__[name]
+		raise AttributeError(name)
+
 	def setPageInfo(self):
 		"""Sets basic page info, required for almost everything"""
 		followRedir = self.followRedir
@@ -204,13 +743,17 @@ class Page(object):
 		self.wikitext = ''
 		self.templates = []
 		self.links = []
+		self.lastrevid = 0
+		self.touched = None
 		return self.namespace
 		
-	def setSection(self, section=None, number=None):
+	def setSection(self, section=None, number=None, local=False):
 		"""Set a section for the page
 		
 		section - the section name
 		number - the section number
+		local - find the section number in the loaded wikitext instead of
+		using the API, see getSections
 		
 		"""
 		if section is None and number is None:
@@ -219,30 +762,91 @@ class Page(object):
 			try:
 				self.section = str(int(number))
 			except ValueError:
-				raise WikiError("Section number must be an int")
+				raise wiki.WikiError("Section number must be an int")
 		else:
-			self.section = self.__getSection(section)
+			self.section = self.__getSection(section, local)
 		self.wikitext = ''
 		return self.section
 	
-	def __getSection(self, section):
+	def __getSection(self, section, local=False):
+		return self.getSectionNumbers([section], local)[section]
+
+	def getSectionNumbers(self, names, local=False):
+		"""Find the numbers of several sections at once
+		
+		names - list of section names or anchors
+		local - find the sections in the loaded wikitext, see getSections
+		
+		Returns a dict of names to section numbers (as strings, as used
+		by setSection and edit), or False for sections that weren't found
+		
+		"""
+		numbers = dict([(name, False) for name in names])
+		for item in self.getSections(local=local):
+			if item['index'].startswith('T'): # TODO: It would be cool if it set the page title to the template in this case 
+				continue
+			for key in (item['line'], item['anchor']):
+				if key in numbers and numbers[key] is False:
+					numbers[key] = item['index']
+		return numbers
+
+	def getSections(self, force=False, local=False, revid=None):
+		"""Gets the list of sections on the page
+		
+		force - load the list even if we already loaded it before
+		local - find the sections in the wikitext, if the whole page is loaded,
+		instead of using action=parse. This does no request, but sections
+		from transcluded pages and headings not made with = signs are not found.
+		revid - get the sections of this revision instead of the current one
+		
+		Returns a list of dicts in the same format as action=parse&prop=sections:
+		{u'anchor': u'Section_name',
+		 u'index': u'1', # number to use for setSection or edit
+		 u'level': u'2', # number of = signs
+		 u'line': u'Section name',
+		 u'number': u'1', # number in the table of contents
+		 u'toclevel': 1
+		}
+		The list is cached for the revision or wikitext it was made from. When
+		lastrevid or the wikitext changes, e.g. after an edit, it is loaded again.
+		If the revision isn't known, a list from action=parse isn't reused.
+		
+		"""
+		if revid:
+			if self.sectionindex and not force and self.sectionsource == ('revid', revid):
+				return self.sectionindex
+		elif self.sectionindex and not force and self.__sectionsCurrent():
+			return self.sectionindex
+		if local and not revid and self.wikitext and self.section is False:
+			self.sectionindex = findSections(self.wikitext)
+			self.sectionsource = ('text', hash(self.wikitext))
+			return self.sectionindex
 		if not self.title:
 			self.setPageInfo()
 		params = {
 			'action': 'parse',
-			'page':self.title,
-			'prop':'sections'
+			'prop':'sections|revid'
 		}
-		number = False
+		# Without revid, parse the current page, not lastrevid, so the
+		# numbers are right for editing it
+		if revid:
+			params['oldid'] = revid
+		else:
+			params['page'] = self.title
 		req = api.APIRequest(self.site, params)
 		response = req.query()
-		for item in response['parse']['sections']:
-			if section == item['line'] or section == item['anchor']:
-				if item['index'].startswith('T'): # TODO: It would be cool if it set the page title to the template in this case 
-					continue
-				number = item['index']
-				break
-		return number
+		self.sectionindex = response['parse']['sections']
+		self.sectionsource = ('revid', response['parse'].get('revid', 0))
+		return self.sectionindex
+	
+	def __sectionsCurrent(self):
+		# Is sectionindex still right for the current revision or text?
+		if self.sectionsource is None:
+			return False
+		(kind, value) = self.sectionsource
+		if kind == 'text':
+			return self.section is False and bool(self.wikitext) and hash(self.wikitext) == value
+		return self.lastrevid != 0 and value == self.lastrevid
 		
 	def canHaveSubpages(self):
 		"""Is the page in a namespace that allows subpages?"""
@@ -250,8 +854,15 @@ class Page(object):
 			self.setPageInfo()
 		return 'subpages' in self.site.namespaces[self.namespace]
 		
-	def isRedir(self):
-		"""Is the page a redirect?"""
+	def isRedir(self, resolver=None):
+		"""Is the page a redirect?
+		
+		resolver - a redirects.RedirectResolver to use, so the result is
+		cached and can come from an earlier batched query
+		
+		"""
+		if resolver is not None and self.title:
+			return resolver.isRedirect(self.title)
 		params = {'action':'query',
 			'redirects':''
 		}
@@ -317,18 +928,28 @@ class Page(object):
 		
 		"""
 	
-		if self.wikitext and not force:
-			return self.wikitext
+		# Read once, with a text store the text can be evicted at any time
+		text = self.wikitext
+		if text and not force:
+			return text
 		if self.pageid == 0 and not self.title:
 			self.setPageInfo()
 		if not self.exists:
 			raise NoPage
+		# Only whole, unexpanded revisions are stored in the revision cache,
+		# if it's used, get the revid first and only get the content if needed
+		cache = self.site.revcache
+		if expandtemplates or self.section is not False:
+			cache = None
+		# Also get the touched timestamp, so refresh() can tell if the link tables changed
 		params = {
 			'action': 'query',
-			'prop': 'revisions',
-			'rvprop': 'content|timestamp',
+			'prop': 'revisions|info',
+			'rvprop': 'content|timestamp|ids',
 			'rvlimit': '1'
 		}
+		if cache is not None:
+			params['rvprop'] = 'timestamp|ids|sha1'
 		if self.pageid:
 			params['pageids'] = self.pageid
 		else:
@@ -344,18 +965,75 @@ class Page(object):
 			if self.pageid == -1:
 				self.exists == False
 				raise NoPage
-		self.wikitext = response['query']['pages'][str(self.pageid)]['revisions'][0]['*'].encode('utf-8')
-		self.lastedittime = response['query']['pages'][str(self.pageid)]['revisions'][0]['timestamp']
-		return self.wikitext
+		pagedata = response['query']['pages'][str(self.pageid)]
+		rev = pagedata['revisions'][0]
+		touched = pagedata.get('touched')
+		if cache is not None:
+			text = cache.get(rev['revid'], rev.get('sha1'))
+			if text is None:
+				params = {
+					'action': 'query',
+					'prop': 'revisions',
+					'rvprop': 'content|timestamp|ids|sha1',
+					'revids': rev['revid']
+				}
+				req = api.APIRequest(self.site, params)
+				response = req.query(False)
+				rev = response['query']['pages'][str(self.pageid)]['revisions'][0]
+				text = rev['*'].encode('utf-8')
+				cache.put(rev['revid'], text, rev.get('sha1'))
+		else:
+			text = rev['*'].encode('utf-8')
+		self.wikitext = text
+		self.lastedittime = rev['timestamp']
+		self.lastrevid = rev['revid']
+		self.touched = touched
+		return text
+	
+	def __getFullText(self):
+		# The text of the whole page, even if a section is set
+		if self.section is False:
+			return self.getWikiText()
+		if self.pageid == 0 and not self.title:
+			self.setPageInfo()
+		if not self.exists:
+			raise NoPage
+		cache = self.site.revcache
+		if cache is not None and self.lastrevid:
+			text = cache.get(self.lastrevid)
+			if text is not None:
+				return text
+		params = {
+			'action': 'query',
+			'prop': 'revisions',
+			'rvprop': 'content|ids',
+		}
+		if self.lastrevid:
+			params['revids'] = self.lastrevid
+		elif self.pageid:
+			params['pageids'] = self.pageid
+		else:
+			params['titles'] = self.title
+		req = api.APIRequest(self.site, params)
+		response = req.query(False)
+		pagedata = response['query']['pages'].values()[0]
+		if 'revisions' not in pagedata:
+			raise NoPage
+		return pagedata['revisions'][0]['*'].encode('utf-8')
 	
-	def getLinks(self, force=False):
+	def getLinks(self, force=False, local=False):
 		"""Gets a list of all the internal links *on* the page
 		
 		force - load the list even if we already loaded it before
+		local - find the links in the wikitext instead of asking the API,
+		see extractLinks. No request is needed if the wikitext is already loaded.
+		The result isn't cached, a later call without local still uses the API
 		
 		"""
 		if self.links and not force:
 			return self.links
+		if local:
+			return extractLinks(self.__getFullText(), self.site, self.title)
 		if self.pageid == 0 and not self.title:
 			self.setPageInfo()
 		if not self.exists:
@@ -392,26 +1070,172 @@ class Page(object):
 			params['titles'] = self.title
 		req = api.APIRequest(self.site, params)
 		response = req.query(False)
-		for pr in response['query'].values()[0].values()[0]['protection']:
-			if pr['level']: 
+		self.__setProtection(response['query'].values()[0].values()[0]['protection'])
+		return self.protection
+
+	def __setProtection(self, protection):
+		for pr in protection:
+			if pr['level']:
 				if pr['expiry'] == 'infinity':
 					expiry = 'infinity'
 				else:
 					expiry = datetime.datetime.strptime(pr['expiry'],'%Y-%m-%dT%H:%M:%SZ')
 				self.protection[pr['type']] = {
-					'expiry': expiry, 
+					'expiry': expiry,
 					'level': pr['level']
 					}
-		return self.protection
+
+	def load(self, props=loadableProps, force=False):
+		"""Load several kinds of page data with a single query
+
+		props - list of data to load, any of 'info', 'links', 'templates',
+		'categories', and 'protection' (the default is all of them)
+		force - load the data even if we already loaded it before
+
+		Fills the same caches as getLinks, getTemplates, getCategories and
+		getProtection, 'info' updates pageid, namespace, title and exists.
+		For loading data for many pages, use pagelist.loadProps
+
+		"""
+		if not force:
+			props = [p for p in props if not getattr(self, p, False)]
+		if not props:
+			return self
+		if self.pageid == 0 and not self.title:
+			self.setPageInfo()
+		params = loadParams(self.site, props)
+		if self.pageid:
+			params['pageids'] = self.pageid
+		else:
+			params['titles'] = self.title
+		self._resetProps(props)
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
+			for key in data['query']['pages']:
+				self._setFromQuery(key, data['query']['pages'][key], props)
+		return self
+
+	def refresh(self):
+		"""Reload the cached data only if the page has changed
+
+		Does a prop=info query to compare the current revision id and
+		touched timestamp of the page to the ones from when the data was
+		loaded. If there is a new revision, the wikitext, links, templates,
+		categories, and protection are reloaded; if only the touched timestamp
+		changed (e.g. a template used on the page was edited), only the links,
+		templates and categories are. Data that wasn't loaded before isn't loaded.
+		For checking many pages, use pagelist.refreshPages
+
+		Returns True if the page changed
+
+		"""
+		if self.pageid == 0 and not self.title:
+			self.setPageInfo()
+		params = {
+			'action': 'query',
+			'prop': 'info',
+		}
+		if self.pageid:
+			params['pageids'] = self.pageid
+		else:
+			params['titles'] = self.title
+		req = api.APIRequest(self.site, params)
+		response = req.query(False)
+		key = response['query']['pages'].keys()[0]
+		(changed, reloadtext, props) = self._invalidate(key, response['query']['pages'][key])
+		if reloadtext:
+			self.getWikiText()
+		if props:
+			self.load(props)
+		return changed
+
+	def _invalidate(self, key, pagedata):
+		"""Clear the cached data that is out of date according to a prop=info result
+
+		Returns a tuple of (whether the page changed, whether the wikitext
+		needs to be reloaded, list of props to reload with load())
+
+		"""
+		lastrevid = pagedata.get('lastrevid', 0)
+		touched = pagedata.get('touched')
+		revchanged = lastrevid != self.lastrevid
+		# If touched wasn't recorded, the link tables may be out of date,
+		# but we can't tell whether the page changed
+		tableschanged = revchanged or touched != self.touched
+		changed = revchanged or (self.touched is not None and touched != self.touched)
+		reloadtext = False
+		props = []
+		if tableschanged:
+			for prop in ('links', 'templates', 'categories'):
+				if getattr(self, prop):
+					props.append(prop)
+			if revchanged and self.protection:
+				props.append('protection')
+			self._resetProps(props)
+			if revchanged and self.wikitext:
+				self.wikitext = ''
+				reloadtext = True
+		self._setFromQuery(key, pagedata, ['info'])
+		if not self.exists:
+			# Nothing to reload for a deleted page
+			return (changed, False, [])
+		return (changed, reloadtext, props)
+
+	def _resetProps(self, props):
+		"""Clear the cached data for props before loading it again"""
+		for prop in ('links', 'templates', 'categories'):
+			if prop in props:
+				setattr(self, prop, [])
+		if 'protection' in props:
+			self.protection = {}
+
+	def _setFromQuery(self, key, pagedata, props):
+		"""Add data from one page of an action=query result to the caches
+
+		key - the key of the page in the result, i.e. the pageid
+		pagedata - the result for the page
+		props - list of data that was requested, same as for load()
+
+		Lists are added to, not replaced, so this can be called for each
+		part of a query with continuations.
+
+		"""
+		if 'missing' in pagedata:
+			self.exists = False
+		elif int(key) > 0:
+			self.exists = True
+			self.pageid = int(key)
+		if 'info' in props:
+			self.lastrevid = pagedata.get('lastrevid', 0)
+			self.touched = pagedata.get('touched')
+		if 'info' in props and 'title' in pagedata:
+			self.namespace = int(pagedata['ns'])
+			if self.title != pagedata['title']:
+				self.title = pagedata['title']
+				if self.namespace != 0:
+					self.unprefixedtitle = self.title.split(':', 1)[1]
+				else:
+					self.unprefixedtitle = self.title
+				self.urltitle = urllib.quote(self.title.encode('utf-8')).replace('%20', '_').replace('%2F', '/')
+		for prop in ('links', 'templates', 'categories'):
+			if prop in props and prop in pagedata:
+				getattr(self, prop).extend([item['title'] for item in pagedata[prop]])
+		if 'protection' in props and 'protection' in pagedata:
+			self.__setProtection(pagedata['protection'])
 	
-	def getTemplates(self, force=False):
+	def getTemplates(self, force=False, local=False):
 		"""Gets all list of all the templates on the page
 		
 		force - load the list even if we already loaded it before
+		local - find the templates in the wikitext instead of asking the API,
+		see extractTemplates. No request is needed if the wikitext is already loaded.
+		The result isn't cached, a later call without local still uses the API
 		
 		"""	
 		if self.templates and not force:
 			return self.templates
+		if local:
+			return extractTemplates(self.__getFullText(), self.site)
 		if self.pageid == 0 and not self.title:
 			self.setPageInfo()
 		if not self.exists:
@@ -431,14 +1255,19 @@ class Page(object):
 			self.templates.extend(self.__extractToList(data, 'templates'))
 		return self.templates
 	
-	def getCategories(self, force=False):
+	def getCategories(self, force=False, local=False):
 		"""Gets all list of all the categories on the page
 		
 		force - load the list even if we already loaded it before
+		local - find the categories in the wikitext instead of asking the API,
+		see extractCategories. No request is needed if the wikitext is already loaded.
+		The result isn't cached, a later call without local still uses the API
 		
 		"""	
 		if self.categories and not force:
 			return self.categories
+		if local:
+			return extractCategories(self.__getFullText(), self.site)
 		if self.pageid == 0 and not self.title:
 			self.setPageInfo()
 		if not self.exists:
@@ -458,7 +1287,7 @@ class Page(object):
 			self.categories.extend(self.__extractToList(data, 'categories'))
 		return self.categories
 		
-	def getHistory(self, direction='older', content=True, limit='all'):
+	def getHistory(self, direction='older', content=True, limit='all', start=None, end=None, startid=None, endid=None):
 		"""Get the history of a page
 		
 		direction - 2 options: 'older' (default) - start with the current revision and get older ones
@@ -466,6 +1295,9 @@ class Page(object):
 		content - If False, get only metadata (timestamp, edit summary, user, etc)
 			If True (default), also get the revision text
 		limit - Only retrieve a certain number of revisions. If 'all' (default), all revisions are returned 
+		start/end - Only get revisions between these timestamps, given as 
+			datetime objects or strings in the API's format
+		startid/endid - Only get revisions between these revision ids
 		
 		The data is returned in essentially the same format as the API, a list of dicts that look like:
 		{u'*': u"Page content", # Only returned when content=True
@@ -483,40 +1315,80 @@ class Page(object):
 		
 		Note that unlike other get* functions, the data is not cached
 		"""
-		max = limit
-		if limit == 'all':
-			max = float("inf")
-		if limit == 'all' or limit > self.site.limit:
-			limit = self.site.limit
 		history = []
-		rvc = None
-		while True:
-			revs, rvc = self.__getHistoryInternal(direction, content, limit, rvc)
-			history = history+revs
-			if len(history) == max or rvc is None:
-				break
-			if max - len(history) < self.site.limit:
-				limit = max - len(history)
+		for revs in self.__getHistoryBatches(direction, content, limit, start, end, startid, endid):
+			history.extend(revs)
 		return history
 		
-	def getHistoryGen(self, direction='older', content=True, limit='all'):
+	def getHistoryGen(self, direction='older', content=True, limit='all', start=None, end=None, startid=None, endid=None, prefetch=False):
 		"""Generator function for page history
 		
-		The interface is the same as getHistory, but it will only retrieve 1 revision at a time.
-		This will be slower and have much higher network overhead, but does not require storing
-		the entire page history in memory	
+		The interface is the same as getHistory, but revisions are yielded one at a time,
+		so the entire history is never stored in memory. Revisions are still requested
+		in batches of the largest size the API allows.
+		prefetch - request the next batch in a background thread while the 
+		current one is being processed
 		"""
+		batches = self.__getHistoryBatches(direction, content, limit, start, end, startid, endid)
+		if prefetch:
+			batches = api.prefetchGen(batches)
+		for revs in batches:
+			for rev in revs:
+				yield rev
+	
+	def __getHistoryBatches(self, direction, content, limit, start, end, startid, endid):
 		max = limit
+		if limit == 'all':
+			max = float("inf")
+		# With a revision cache, get the metadata first, then only the content that isn't cached
+		cache = None
+		if content:
+			cache = self.site.revcache
+		# The API allows 10 times fewer revisions per request when getting content
+		if content and cache is None:
+			batchsize = self.site.limit/10
+		else:
+			batchsize = self.site.limit
 		count = 0
 		rvc = None
-		while True:
-			revs, rvc = self.__getHistoryInternal(direction, content, 1, rvc)
-			yield revs[0]
-			count += 1
-			if count == max or rvc is None:
+		while count < max:
+			revs, rvc = self.__getHistoryInternal(direction, content and cache is None, int(min(batchsize, max-count)), rvc, start, end, startid, endid)
+			if cache is not None:
+				self.__addContent(revs, cache)
+			count += len(revs)
+			yield revs
+			if rvc is None:
 				break
 	
-	def __getHistoryInternal(self, direction, content, limit, rvcontinue):
+	def __addContent(self, revs, cache):
+		missing = {}
+		for rev in revs:
+			text = cache.get(rev['revid'], rev.get('sha1'))
+			if text is None:
+				missing[rev['revid']] = rev
+			else:
+				rev['*'] = text.decode('utf-8')
+		revids = missing.keys()
+		batchsize = self.site.limit/10
+		for x in range(0, len(revids), batchsize):
+			params = {
+				'action':'query',
+				'prop':'revisions',
+				'rvprop':'ids|sha1|content',
+				'revids':'|'.join([str(revid) for revid in revids[x:x+batchsize]])
+			}
+			req = api.APIRequest(self.site, params)
+			for data in req.queryGen():
+				for pagedata in data['query'].get('pages', {}).values():
+					for rev in pagedata.get('revisions', []):
+						if '*' not in rev or rev['revid'] not in missing:
+							continue
+						for key in ('*', 'contentformat', 'contentmodel'):
+							if key in rev:
+								missing[rev['revid']][key] = rev[key]
+						cache.put(rev['revid'], rev['*'], rev.get('sha1'))
+	
+	def __getHistoryInternal(self, direction, content, limit, rvcontinue, start=None, end=None, startid=None, endid=None):
 	
 		if self.pageid == 0 and not self.title:
 			self.setPageInfo()
@@ -539,6 +1411,14 @@ class Page(object):
 
 		if content:
 			params['rvprop']+='|content'
+		if start is not None:
+			params['rvstart'] = apiTimestamp(start)
+		if end is not None:
+			params['rvend'] = apiTimestamp(end)
+		if startid is not None:
+			params['rvstartid'] = startid
+		if endid is not None:
+			params['rvendid'] = endid
 		if rvcontinue:
 			params['continue'] = rvcontinue['continue']
 			params['rvcontinue'] = rvcontinue['rvcontinue']
@@ -547,7 +1427,7 @@ class Page(object):
 		id = response['query']['pages'].keys()[0]
 		if not self.pageid:
 			self.pageid = int(id)
-		revs = response['query']['pages'][id]['revisions']
+		revs = response['query']['pages'][id].get('revisions', [])
 		rvc = None
 		if 'continue' in response:
 			rvc = response['continue']
@@ -625,12 +1505,21 @@ class Page(object):
 			params['md5'] = md5(hashtext).hexdigest()
 		params.update(kwargs)
 		req = api.APIRequest(self.site, params, write=True)
-		result = req.query()
+		try:
+			result = req.query()
+		except api.APIError, exc:
+			# The cached token may have expired
+			if exc.args[0] != 'badtoken':
+				raise
+			req.changeParam('token', self.site.getToken('csrf', force=True))
+			result = req.query()
 		if 'edit' in result and result['edit']['result'] == 'Success':
 			self.wikitext = ''
 			self.links = []
 			self.templates = []
 			self.exists = True
+			if 'newrevid' in result['edit']:
+				self.lastrevid = result['edit']['newrevid']
 		return result
 		
 	def move(self, mvto, reason=False, movetalk=False, noredirect=False, watch=False, unwatch=False):
@@ -778,6 +1667,9 @@ class Page(object):
 	
 	
 	def __hash__(self):
+		# Same as __eq__, use the title if there is one, pageid is 0 for unchecked pages
+		if self.title:
+			return hash(self.title) ^ hash(self.site.apibase)
 		return int(self.pageid) ^ hash(self.site.apibase)
 	
 	def __str__(self):
@@ -795,7 +1687,7 @@ class Page(object):
 		return "<"+self.__module__+'.'+self.__class__.__name__+" "+repr(title)+" using "+repr(self.site.apibase)+">"
 	
 	def __eq__(self, other):
-		if not isinstance(other, Page):
+		if not isinstance(other, (Page, PageRef)):
 			return False
 		if self.title:			
 			if self.title == other.title and self.site == other.site:
@@ -806,7 +1698,7 @@ class Page(object):
 		return False
 		
 	def __ne__(self, other):
-		if not isinstance(other, Page):
+		if not isinstance(other, (Page, PageRef)):
 			return True
 		if self.title:
 			if self.title == other.title and self.site == other.site:
@@ -15,58 +15,61 @@
 # You should have received a copy of the GNU General Public License
 # along with wikitools.  If not, see <http://www.gnu.org/licenses/>.
 
+import wiki
 import api
 import page
 import category
 import wikifile
 import math
+import threading
+import os
+import time
+try:
+	import json
+except:
+	import simplejson as json
 
-def listFromQuery(site, queryresult):
+def listFromQuery(site, queryresult, refonly=False, lazy=False):
 	"""Generate a list of pages from an API query result
 	
 	queryresult is the list of pages from a list or generator query
 	e.g. - for a list=categorymembers query, use result['query']['categorymembers']
 	for a generator query, use result['query']['pages']
+	refonly - set to True to make a list of page.PageRef objects, which use
+	much less memory than Page objects
+	lazy - add the pages to a PageGroup, so their wikitext and categories
+	are loaded in batches when first used on any of them
 	
 	"""
 	ret = []
 	if isinstance(queryresult, list):
-		for item in queryresult:
-			pageid = False
-			if 'pageid' in item:
-				pageid = item['pageid']
-			if item['ns'] == 14:
-				item = category.Category(site, title=item['title'], check=False, followRedir=False, pageid=pageid)
-			elif item['ns'] == 6:
-				item = wikifile.File(site, title=item['title'], check=False, followRedir=False, pageid=pageid)
-			else:
-				item = page.Page(site, title=item['title'], check=False, followRedir=False, pageid=pageid)
-			ret.append(item)
+		items = queryresult
 	else:
-		for key in queryresult.keys():
-			item = queryresult[key]
-			pageid = False
-			if 'pageid' in item:
-				pageid = item['pageid']
-			if item['ns'] == 14:
-				item = category.Category(site, title=item['title'], check=False, followRedir=False, pageid=pageid)
-			elif item['ns'] == 6:
-				item = wikifile.File(site, title=item['title'], check=False, followRedir=False, pageid=pageid)
-			else:
-				item = page.Page(site, title=item['title'], check=False, followRedir=False, pageid=pageid)
-			ret.append(item)
+		items = queryresult.values()
+	for item in items:
+		item = page.PageRef(site, item['title'], item.get('pageid', 0), item['ns'])
+		if not refonly:
+			item = item.toPage()
+		ret.append(item)
+	if lazy and not refonly:
+		group = PageGroup(site)
+		for item in ret:
+			group.add(item)
 	return ret
 
-def listFromTitles(site, titles, check=True, followRedir=False):
+def listFromTitles(site, titles, check=True, followRedir=False, lazy=False):
 	"""Create a list of page objects from a list of titles
 	
 	check and followRedir have the same meaning as in page.Page
+	lazy - add the pages to a PageGroup, so their wikitext and categories,
+	and with check=False their existence and pageid, are loaded in
+	batches when first used on any of them
 	
 	"""
 	ret = []
 	if not check:
 		for title in titles:
-			title = page.Page(site, title=title, check=False)
+			title = page.getPage(site, title=title)
 			ret.append(title)
 	else:
 		querylist = []
@@ -95,6 +98,11 @@ def listFromTitles(site, titles, check=True, followRedir=False):
 				obj = res['query']['pages'][key]
 				item = makePage(key, obj, site)
 				ret.append(item)
+	if lazy:
+		group = PageGroup(site)
+		for item in ret:
+			if item:
+				group.add(item)
 	return ret
 
 def listFromPageids(site, pageids, check=True, followRedir=False):			
@@ -106,7 +114,7 @@ def listFromPageids(site, pageids, check=True, followRedir=False):
 	ret = []
 	if not check:
 		for id in pageids:
-			title = page.Page(site, pageid=id, check=False)
+			title = page.getPage(site, pageid=id)
 			ret.append(title)
 	else:
 		querylist = []
@@ -144,16 +152,597 @@ def makePage(key, result, site):
 	title=False
 	if 'title' in result:
 		title = result['title']
-	if 'ns' in result and result['ns'] == 14:
-		item = category.Category(site, title=title, check=False, followRedir=False, pageid=key)
-	elif 'ns' in result and result['ns'] == 6:
-		item = wikifile.File(site, title=title, check=False, followRedir=False, pageid=key)
-	else:
-		item = page.Page(site, title=title, check=False, followRedir=False, pageid=key)
+	if 'invalid' in result:
+		return False
+	item = page.getPage(site, title=title, pageid=key)
 	if 'missing' in result:
 		item.exists = False
-	if 'invalid' in result:
-		item = False
 	if 'ns' in result:
 		item.setNamespace(int(result['ns']))
 	return item
+
+def iterWikiText(site, pages, batch=50, workers=1):
+	"""Generator for the current wikitext of many pages
+	
+	pages - list of Page objects and/or titles
+	batch - number of pages to get per request, at most 50
+	(500 for users with the apihighlimits right)
+	workers - number of requests to run concurrently
+	
+	Yields (page, text, timestamp, revid) tuples as each batch arrives,
+	so the order is not necessarily the same as pages. Page objects given
+	have their wikitext set as if getWikiText() had been called, titles
+	are converted to Page objects. Missing and invalid pages are skipped.
+	If the site has a revision cache, only the content of revisions that
+	aren't in the cache is downloaded.
+	
+	"""
+	cache = site.revcache
+	def getBatch(job):
+		params = {'action':'query',
+			'prop':'revisions|info',
+			'rvprop':'content|timestamp|ids|sha1',
+		}
+		if cache is not None:
+			params['rvprop'] = 'timestamp|ids|sha1'
+		items = _setBatchParam(params, job)
+		missing = {}
+		req = api.APIRequest(site, params)
+		for data in req.queryGen():
+			for (key, obj, item) in _matchResult(site, data, items):
+				# Continued responses may not repeat the info
+				if 'touched' in obj:
+					item._setFromQuery(key, obj, ['info'])
+				if 'revisions' not in obj:
+					continue
+				rev = obj['revisions'][0]
+				if cache is None:
+					text = rev['*'].encode('utf-8')
+				else:
+					text = cache.get(rev['revid'], rev.get('sha1'))
+					if text is None:
+						missing[rev['revid']] = item
+						continue
+				item.wikitext = text
+				item.lastedittime = rev['timestamp']
+				item.lastrevid = rev['revid']
+				yield (item, text, rev['timestamp'], rev['revid'])
+		if not missing:
+			return
+		params = {'action':'query',
+			'prop':'revisions',
+			'rvprop':'content|timestamp|ids|sha1',
+			'revids':'|'.join([str(revid) for revid in missing])
+		}
+		req = api.APIRequest(site, params)
+		for data in req.queryGen():
+			for obj in data['query'].get('pages', {}).values():
+				for rev in obj.get('revisions', []):
+					if '*' not in rev or rev['revid'] not in missing:
+						continue
+					item = missing[rev['revid']]
+					text = rev['*'].encode('utf-8')
+					cache.put(rev['revid'], text, rev.get('sha1'))
+					item.wikitext = text
+					item.lastedittime = rev['timestamp']
+					item.lastrevid = rev['revid']
+					yield (item, text, rev['timestamp'], rev['revid'])
+	return api.threadedGen(getBatch, _batchJobs(site, pages, batch), workers)
+
+def loadProps(site, pages, props=page.loadableProps, batch=50, workers=1):
+	"""Load several kinds of page data for many pages in batched queries
+	
+	pages - list of Page objects and/or titles
+	props - list of data to load, same as for Page.load
+	batch - number of pages to get per request, at most 50
+	(500 for users with the apihighlimits right)
+	workers - number of requests to run concurrently
+	
+	Returns the list of Page objects that were loaded, titles are converted
+	to Page objects. Missing pages are included with exists set to False.
+	
+	"""
+	def getBatch(job):
+		params = page.loadParams(site, props)
+		items = _setBatchParam(params, job)
+		for item in items:
+			if isinstance(item, page.Page):
+				item._resetProps(props)
+		seen = {}
+		req = api.APIRequest(site, params)
+		for data in req.queryGen():
+			for (key, obj, item) in _matchResult(site, data, items):
+				item._setFromQuery(key, obj, props)
+				seen[id(item)] = item
+		return seen.values()
+	return list(api.threadedGen(getBatch, _batchJobs(site, pages, batch), workers))
+
+def refreshPages(site, pages, reload=True, batch=500, workers=1):
+	"""Find which of many pages have changed and reload their cached data
+	
+	pages - list of Page objects
+	reload - reload the cached data of pages that changed, the same way
+	as Page.refresh, otherwise it is only cleared
+	batch - number of pages to check per request, at most 50
+	(500 for users with the apihighlimits right)
+	workers - number of requests to run concurrently
+	
+	Changes are detected by comparing the revision id and touched timestamp
+	from a prop=info query to the ones from when the data was loaded, so
+	for unchanged pages nothing but that query is done.
+	Returns the list of pages that changed
+	
+	"""
+	def check(job):
+		params = {'action':'query',
+			'prop':'info',
+		}
+		items = _setBatchParam(params, job)
+		req = api.APIRequest(site, params)
+		for data in req.queryGen():
+			for (key, obj, item) in _matchResult(site, data, items):
+				yield (item, item._invalidate(key, obj))
+	changed = []
+	textpages = []
+	propgroups = {}
+	for (item, (pagechanged, reloadtext, props)) in api.threadedGen(check, _batchJobs(site, pages, batch), workers):
+		if pagechanged:
+			changed.append(item)
+		if reloadtext:
+			textpages.append(item)
+		if props:
+			propgroups.setdefault(tuple(props), []).append(item)
+	if reload:
+		# iterWikiText only gets whole pages
+		for item in [p for p in textpages if p.section is not False]:
+			item.getWikiText()
+		for x in iterWikiText(site, [p for p in textpages if p.section is False], workers=workers):
+			pass
+		for props in propgroups:
+			loadProps(site, propgroups[props], props, workers=workers)
+	return changed
+
+def getCategoryCounts(site, categories, batch=50, workers=1):
+	"""Get the number of members of many categories in batched queries
+	
+	categories - list of Category objects and/or titles
+	batch - number of categories to get per request, at most 50
+	(500 for users with the apihighlimits right)
+	workers - number of requests to run concurrently
+	
+	Uses prop=categoryinfo, so the members aren't listed. Returns a dict of
+	titles to dicts of counts, the same as Category.getCounts, Category
+	objects given have their categoryinfo set.
+	
+	"""
+	def getBatch(job):
+		params = {'action':'query',
+			'prop':'categoryinfo',
+		}
+		items = _setBatchParam(params, job)
+		req = api.APIRequest(site, params)
+		for data in req.queryGen():
+			for (key, obj, item) in _matchResult(site, data, items):
+				if isinstance(item, category.Category):
+					yield (item.title, item._setCounts(obj.get('categoryinfo')))
+	return dict(api.threadedGen(getBatch, _batchJobs(site, categories, batch), workers))
+
+# The parameters to split each kind of list query into ranges with,
+# and whether the end of the range is included in the results
+shardParams = {
+	'categorymembers': ('cmstartsortkeyprefix', 'cmendsortkeyprefix', False),
+	'allpages': ('apfrom', 'apto', True),
+	'allcategories': ('acfrom', 'acto', True),
+	'allimages': ('aifrom', 'aito', True),
+	'allusers': ('aufrom', 'auto', True),
+}
+shardBoundaries = list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+def makeShards(count, boundaries=shardBoundaries):
+	"""Split the titles or sort keys into ranges for shardedQuery
+	
+	count - number of ranges, at most one more than the number of boundaries
+	boundaries - sorted list of strings to choose the ends of the ranges from
+	
+	Returns a list of (start, end) tuples, None means no limit
+	
+	"""
+	count = max(1, min(int(count), len(boundaries)+1))
+	points = [boundaries[x*len(boundaries)/count] for x in range(1, count)]
+	return zip([None]+points, points+[None])
+
+def shardedQuery(site, params, shards, workers=1, checkpoint=None, interval=60):
+	"""Run a list query split into ranges, with the ranges run concurrently
+	
+	params - the parameters of the query, the list must be one of the keys
+	of shardParams
+	shards - list of (start, end) ranges, see makeShards
+	workers - number of ranges to run at the same time
+	checkpoint - name of a file to save the progress of each range in,
+	if it exists the query continues from where it was stopped
+	interval - minimum number of seconds between saves of the checkpoint
+	
+	Generator for the items of the list from all ranges, the order of
+	items from different ranges is mixed. The progress of a range is
+	recorded (see api.QueryCheckpoint) after all the results of a request
+	were used, so after resuming only the items from the last request can
+	be repeated. The file is removed when the query is finished.
+	
+	"""
+	(startparam, endparam, inclusive) = shardParams[params['list']]
+	listkey = params['list']
+	shards = [tuple(shard) for shard in shards]
+	queries = []
+	for (start, end) in shards:
+		query = params.copy()
+		if start is not None:
+			query[startparam] = start
+		if end is not None:
+			query[endparam] = end
+		queries.append(query)
+	progress = [api.QueryCheckpoint() for shard in shards]
+	if checkpoint is not None and os.path.exists(checkpoint):
+		f = open(checkpoint, 'rb')
+		try:
+			saved = json.loads(f.read())
+		finally:
+			f.close()
+		if [tuple(shard) for shard in saved['shards']] != shards:
+			raise wiki.WikiError("Checkpoint file "+repr(checkpoint)+" is for a different query")
+		for (index, state) in enumerate(saved['states']):
+			progress[index].load(state)
+	for (index, query) in enumerate(queries):
+		progress[index].start(query)
+	def runShard(index):
+		# A copy, progress is only recorded once the results are used
+		resume = api.QueryCheckpoint()
+		resume.load(progress[index].dump())
+		end = shards[index][1]
+		if end is not None:
+			endname = _normalizeRangeName(site, end)
+		req = api.APIRequest(site, queries[index])
+		for data in req.queryGen(resume):
+			items = data.get('query', {}).get(listkey, [])
+			if inclusive and end is not None:
+				# The start of the next range gets this one
+				items = [item for item in items if _rangeName(site, listkey, item) != endname]
+			yield (index, items, data.get('continue'))
+	lastsave = time.time()
+	finished = False
+	try:
+		for (index, items, state) in api.threadedGen(runShard, range(len(shards)), workers):
+			for item in items:
+				yield item
+			progress[index].update(state)
+			if checkpoint is not None and (not state or time.time() - lastsave >= interval):
+				_writeCheckpoint(checkpoint, {'shards':shards, 'states':[cp.dump() for cp in progress]})
+				lastsave = time.time()
+		finished = True
+	finally:
+		if checkpoint is not None:
+			if finished:
+				if os.path.exists(checkpoint):
+					os.remove(checkpoint)
+			else:
+				# Stopped early, save what was done
+				_writeCheckpoint(checkpoint, {'shards':shards, 'states':[cp.dump() for cp in progress]})
+
+def _rangeName(site, listkey, item):
+	"""The name of an item of a list query, as used in its from/to parameters"""
+	if listkey == 'allcategories':
+		name = item.get('*', item.get('category', ''))
+	elif listkey == 'allusers':
+		name = item['name']
+	else:
+		# allpages and allimages use titles without the namespace
+		name = item['title']
+		if (listkey == 'allimages' or item.get('ns', 0) != 0) and ':' in name:
+			name = name.split(':', 1)[1]
+	return _normalizeRangeName(site, name)
+
+def _normalizeRangeName(site, name):
+	name = name.replace('_', ' ')
+	if site.siteinfo.get('case', 'first-letter') == 'first-letter':
+		name = name[:1].upper() + name[1:]
+	return name
+
+def _writeCheckpoint(filename, data):
+	# Write to a temporary file first so a failed write doesn't lose the old checkpoint
+	tmpname = filename+'.tmp'
+	f = open(tmpname, 'wb')
+	try:
+		f.write(json.dumps(data))
+	finally:
+		f.close()
+	if os.name == 'nt' and os.path.exists(filename):
+		os.remove(filename)
+	os.rename(tmpname, filename)
+
+class PageGroup(object):
+	"""A group of pages whose data is loaded in batches when first used
+	
+	The exists, pageid, namespace, wikitext and categories attributes of
+	pages added to the group are not loaded until one of them is used
+	on any page in the group. Then that data is loaded for all pages in
+	the group that still need it, using loadProps or iterWikiText, so a
+	simple loop over the pages makes one request per batch instead of one
+	per page.
+	
+	"""
+	# Which kind of data each attribute is loaded with
+	kinds = {'exists':'info', 'pageid':'info', 'namespace':'info',
+		'categories':'categories', 'wikitext':'wikitext'}
+	def __init__(self, site, batch=50, workers=1):
+		"""
+		site - A wiki object
+		batch - number of pages to load per request, at most 50
+		(500 for users with the apihighlimits right)
+		workers - number of requests to run concurrently
+		"""
+		self.site = site
+		self.batch = batch
+		self.workers = workers
+		self.pending = {'info':{}, 'categories':{}, 'wikitext':{}}
+		self.defaults = {} # id of the page -> values to use before loading
+		self.loading = {} # (kind, id of the page) -> Event set when it's loaded
+		self.lock = threading.RLock()
+	
+	def add(self, item):
+		"""Add a Page object to the group
+		
+		Only data that isn't already loaded is deferred, pages that
+		are already in a group are not changed.
+		
+		"""
+		if item.lazygroup is not None:
+			return item
+		attrs = {}
+		if item.pageid == 0 and item.lastrevid == 0 and item.title:
+			attrs['exists'] = item.exists
+			attrs['pageid'] = item.pageid
+		if item.namespace is False and item.pageid:
+			attrs['namespace'] = item.namespace
+		if not item.categories:
+			attrs['categories'] = item.categories
+		if not item.wikitext and item.section is False:
+			attrs['wikitext'] = ''
+		if not attrs:
+			return item
+		self.lock.acquire()
+		try:
+			for attr in attrs:
+				self.pending[self.kinds[attr]][id(item)] = item
+				if attr == 'wikitext':
+					del item._wikitext
+				else:
+					delattr(item, attr)
+			self.defaults[id(item)] = attrs
+			item.lazygroup = self
+		finally:
+			self.lock.release()
+		return item
+	
+	def load(self, attr, item=None):
+		"""Load the data for attr on all pages in the group that need it
+		
+		item - the page the data is needed for. If another thread is
+		already loading it, wait for that instead
+		
+		Called by Page objects in the group when a deferred attribute is used
+		
+		"""
+		kind = self.kinds[attr]
+		while True:
+			self.lock.acquire()
+			try:
+				event = None
+				if item is not None:
+					event = self.loading.get((kind, id(item)))
+				if event is None:
+					(pages, info, event) = self.__startLoad(kind)
+					break
+			finally:
+				self.lock.release()
+			event.wait()
+			if item is None or attr not in self.defaults.get(id(item), {}):
+				return
+			# The other thread's load failed, the page is pending again
+		if not pages:
+			return
+		loaded = False
+		try:
+			self.__fetch(kind, pages, info)
+			loaded = True
+		finally:
+			self.lock.acquire()
+			try:
+				for member in pages:
+					del self.loading[(kind, id(member))]
+					if not loaded:
+						self.pending[kind][id(member)] = member
+				for member in info:
+					del self.loading[('info', id(member))]
+					if not loaded:
+						self.pending['info'][id(member)] = member
+			finally:
+				self.lock.release()
+			event.set()
+	
+	def __startLoad(self, kind):
+		# Take the pending pages of a kind, with the lock held
+		pages = self.pending[kind].values()
+		self.pending[kind] = {}
+		info = []
+		if kind != 'info':
+			# Get the info for the same pages in the same query
+			info = [p for p in pages if id(p) in self.pending['info']]
+			for member in info:
+				del self.pending['info'][id(member)]
+		# Other threads wait for this when they need the data
+		event = threading.Event()
+		for member in pages:
+			self.loading[(kind, id(member))] = event
+		for member in info:
+			self.loading[('info', id(member))] = event
+		return (pages, info, event)
+	
+	def __fetch(self, kind, pages, info):
+		# The data is loaded into copies of the pages, so the deferred
+		# attributes of the pages stay unset until it's all loaded and
+		# other threads wait for it instead of seeing the placeholders,
+		# and the worker threads don't come back here.
+		shadows = []
+		self.lock.acquire()
+		try:
+			for member in pages:
+				shadows.append(self.__makeShadow(member))
+		finally:
+			self.lock.release()
+		copies = [shadow for (shadow, initial) in shadows]
+		infoids = set([id(p) for p in info])
+		if kind == 'wikitext':
+			# iterWikiText gets the info too
+			for x in iterWikiText(self.site, copies, self.batch, self.workers):
+				pass
+		elif kind == 'categories':
+			withinfo = [copies[i] for (i, p) in enumerate(pages) if id(p) in infoids]
+			rest = [copies[i] for (i, p) in enumerate(pages) if id(p) not in infoids]
+			if withinfo:
+				loadProps(self.site, withinfo, ['info', 'categories'], self.batch, self.workers)
+			if rest:
+				loadProps(self.site, rest, ['categories'], self.batch, self.workers)
+		else:
+			loadProps(self.site, copies, ['info'], self.batch, self.workers)
+		self.lock.acquire()
+		try:
+			for (member, (shadow, initial)) in zip(pages, shadows):
+				kinds = [kind]
+				if id(member) in infoids:
+					kinds.append('info')
+				self.__copyBack(member, shadow, initial, kinds)
+		finally:
+			self.lock.release()
+	
+	def __makeShadow(self, member):
+		shadow = object.__new__(member.__class__)
+		shadow.__dict__.update(member.__dict__)
+		for (attr, value) in self.defaults.get(id(member), {}).items():
+			if attr == 'wikitext':
+				shadow.__dict__['_wikitext'] = value
+			elif attr == 'categories':
+				shadow.__dict__[attr] = []
+			else:
+				shadow.__dict__[attr] = value
+		shadow.__dict__['lazygroup'] = None
+		return (shadow, dict(shadow.__dict__))
+	
+	def __copyBack(self, member, shadow, initial, kinds):
+		attrs = self.defaults.get(id(member), {})
+		loaded = [attr for attr in attrs.keys() if self.kinds[attr] in kinds]
+		# Other data the loading changed, e.g. lastrevid and touched
+		for (key, value) in shadow.__dict__.items():
+			if key in ('_wikitext', 'lazygroup') or key in loaded:
+				continue
+			if key not in initial or initial[key] is not value:
+				setattr(member, key, value)
+		for attr in loaded:
+			setattr(member, attr, getattr(shadow, attr))
+			del attrs[attr]
+		if not attrs:
+			self.defaults.pop(id(member), None)
+			member.lazygroup = None
+	
+	def __len__(self):
+		return len(self.defaults)
+	
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+str(len(self.defaults))+" pages waiting to load on "+repr(self.site.apibase)+">"
+
+def _batchJobs(site, pages, batch):
+	"""Split pages into jobs of at most batch pages for _setBatchParam
+	
+	Pages with a title are requested with titles=, others with pageids=
+	
+	"""
+	batch = max(1, min(int(batch), int(site.limit)/10))
+	jobs = []
+	for chunk in _chunks(pages, batch):
+		titled = []
+		byid = []
+		for item in chunk:
+			if isinstance(item, page.Page) and not item.title:
+				byid.append(item)
+			else:
+				titled.append(item)
+		if titled:
+			jobs.append(('titles', titled))
+		if byid:
+			jobs.append(('pageids', byid))
+	return jobs
+
+def _setBatchParam(params, job):
+	(param, items) = job
+	if param == 'titles':
+		params['titles'] = u'|'.join([_titleOf(item) for item in items])
+	else:
+		params['pageids'] = '|'.join([str(item.pageid) for item in items])
+	return list(items)
+
+def _chunks(seq, size):
+	seq = list(seq)
+	for x in range(0, len(seq), size):
+		yield seq[x:x+size]
+
+def _titleOf(item):
+	if isinstance(item, page.Page):
+		return item.title
+	if not isinstance(item, unicode):
+		return unicode(item, 'utf8')
+	return item
+
+def _matchResult(site, data, items):
+	"""Match the pages in an action=query result to the objects requested
+	
+	items is the list of Page objects and/or titles used for the request,
+	titles are replaced in the list by Page objects made with makePage, so
+	the same objects are found again in continuations of the same query.
+	Yields (key, pagedata, Page) tuples for each page that is not invalid.
+	
+	"""
+	bytitle = {}
+	byid = {}
+	for (index, item) in enumerate(items):
+		if isinstance(item, page.Page):
+			if item.title:
+				bytitle[item.title] = index
+			if item.pageid:
+				byid[int(item.pageid)] = index
+		else:
+			bytitle[_titleOf(item).replace('_', ' ')] = index
+	for norm in data.get('query', {}).get('normalized', []):
+		if norm['from'] in bytitle:
+			bytitle[norm['to']] = bytitle[norm['from']]
+	for redir in data.get('query', {}).get('redirects', []):
+		if redir['from'] in bytitle:
+			bytitle[redir['to']] = bytitle[redir['from']]
+	for key in data.get('query', {}).get('pages', {}):
+		obj = data['query']['pages'][key]
+		if 'invalid' in obj:
+			continue
+		index = None
+		if int(key) > 0 and int(key) in byid:
+			index = byid[int(key)]
+		elif 'title' in obj and obj['title'] in bytitle:
+			index = bytitle[obj['title']]
+		if index is None:
+			item = makePage(key, obj, site)
+		elif not isinstance(items[index], page.Page):
+			item = makePage(key, obj, site)
+			items[index] = item
+		else:
+			item = items[index]
+			if int(key) > 0 and not item.pageid:
+				item.pageid = int(key)
+			if 'missing' in obj:
+				item.exists = False
+		yield (key, obj, item)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright 2008-2013 Alex Zaddach (mrzmanwiki@gmail.com)
+
+# This file is part of wikitools.
+# wikitools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# wikitools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with wikitools.  If not, see <http://www.gnu.org/licenses/>.
+
+import api
+import page
+
+class RedirectResolver(object):
+	"""Resolves redirects for many titles at once and caches the results"""
+	def __init__(self, site):
+		"""
+		site - A wiki object
+		"""
+		self.site = site
+		self.redirects = {} # redirect title -> title it points to
+		self.notredirects = set() # titles known not to be redirects
+		self.aliases = {} # titles the API normalized differently than normalizeTitle
+
+	def resolve(self, titles, batch=50, workers=1):
+		"""Find where many titles end up after following redirects
+
+		titles - list of titles or Page objects
+		batch - number of titles to check per request, at most 50
+		(500 for users with the apihighlimits right)
+		workers - number of requests to run concurrently
+
+		Only titles not already in the cache are queried. Chains of redirects
+		are followed to the end. Returns a dict of the given titles to the
+		final target title, which is the normalized title itself for pages that
+		aren't redirects, or None for invalid titles.
+
+		"""
+		keys = {}
+		for title in titles:
+			keys[title] = self.__key(title)
+		unknown = set([key for key in keys.values() if key is not None and self.__lookup(key) is None])
+		batch = max(1, min(int(batch), int(self.site.limit)/10))
+		unknown = list(unknown)
+		jobs = [unknown[x:x+batch] for x in range(0, len(unknown), batch)]
+		for (redirects, notredirects, aliases) in api.threadedGen(self.__query, jobs, workers):
+			self.redirects.update(redirects)
+			self.notredirects.update(notredirects)
+			self.aliases.update(aliases)
+		ret = {}
+		for title in keys:
+			if keys[title] is None:
+				ret[title] = None
+			else:
+				ret[title] = self.__follow(keys[title])
+		return ret
+
+	def getTarget(self, title):
+		"""Get the final target of a single title, see resolve()"""
+		return self.resolve([title])[title]
+
+	def isRedirect(self, title):
+		"""Is the title a redirect?"""
+		key = self.__key(title)
+		if key is None:
+			return False
+		if self.aliases.get(key, key) in self.redirects:
+			return True
+		self.resolve([key])
+		return self.aliases.get(key, key) in self.redirects
+
+	def preload(self, namespace=0):
+		"""Load all the redirects in a namespace into the cache
+
+		namespace - namespace number
+
+		Uses generator=allpages with redirect resolution, so each request covers
+		as many redirects as the API allows. The targets the API resolves to
+		are marked as non-redirects, so lookups of the redirects need no request.
+
+		"""
+		params = {'action':'query',
+			'generator':'allpages',
+			'gapnamespace':int(namespace),
+			'gapfilterredir':'redirects',
+			'gaplimit':self.site.limit,
+			'redirects':''
+		}
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
+			query = data.get('query', {})
+			for redir in query.get('redirects', []):
+				self.redirects[redir['from']] = redir['to']
+			# The pages are the ends of the redirects
+			for pagedata in query.get('pages', {}).values():
+				if 'title' in pagedata and 'invalid' not in pagedata:
+					self.notredirects.add(pagedata['title'])
+		# Redirect loops leave a redirect in the pages
+		for title in list(self.notredirects):
+			if title in self.redirects:
+				self.notredirects.discard(title)
+		return self
+
+	def invalidate(self, titles=None):
+		"""Remove titles from the cache, or everything if titles is None"""
+		if titles is None:
+			self.redirects = {}
+			self.notredirects = set()
+			self.aliases = {}
+			return
+		for title in titles:
+			key = self.__key(title)
+			self.redirects.pop(key, None)
+			self.notredirects.discard(key)
+			self.aliases.pop(key, None)
+
+	def __query(self, titles):
+		params = {'action':'query',
+			'titles':u'|'.join(titles),
+			'redirects':''
+		}
+		redirects = {}
+		notredirects = set()
+		aliases = {}
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
+			query = data.get('query', {})
+			for redir in query.get('redirects', []):
+				redirects[redir['from']] = redir['to']
+			for pagedata in query.get('pages', {}).values():
+				if 'title' in pagedata and 'invalid' not in pagedata:
+					notredirects.add(pagedata['title'])
+			for norm in query.get('normalized', []):
+				aliases[norm['from']] = norm['to']
+		# A page left at the end of a redirect loop isn't a normal page
+		for title in list(notredirects):
+			if title in redirects:
+				notredirects.discard(title)
+		return [(redirects, notredirects, aliases)]
+
+	def __key(self, title):
+		if isinstance(title, (page.Page, page.PageRef)):
+			title = title.title
+		try:
+			return page.normalizeTitle(title, self.site)[0]
+		except page.BadTitle:
+			return None
+
+	def __lookup(self, key):
+		# Only known if the end of the chain is known, redirects from
+		# preload() may point to pages that weren't checked
+		target = self.__follow(key)
+		if target in self.notredirects:
+			return target
+		return None
+
+	def __follow(self, key):
+		key = self.aliases.get(key, key)
+		seen = set()
+		while key in self.redirects and key not in seen:
+			seen.add(key)
+			key = self.redirects[key]
+		return key
+
+	def __len__(self):
+		return len(self.redirects)
+
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+str(len(self.redirects))+" redirects on "+repr(self.site.apibase)+">"
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright 2008-2013 Alex Zaddach (mrzmanwiki@gmail.com)
+
+# This file is part of wikitools.
+# wikitools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# wikitools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with wikitools.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import zlib
+import threading
+import thread
+from hashlib import sha1 as sha1hash
+
+class RevisionCache(object):
+	"""An on-disk store of revision content, keyed by revision id
+
+	The content of a revision never changes, so once it is stored it
+	can be used instead of downloading it again. To use it, pass it to
+	Wiki.setRevisionCache.
+
+	"""
+	def __init__(self, path, maxsize=1024*1024*1024):
+		"""
+		path - directory to store the content in, created if it doesn't exist
+		maxsize - approximate maximum size of the cache in bytes,
+		the least recently used revisions are removed when it's exceeded
+		"""
+		self.path = path
+		self.maxsize = maxsize
+		self.size = None # Calculated the first time something is added
+		self.lock = threading.Lock()
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+
+	def get(self, revid, sha1=None):
+		"""Get the content of a revision as a UTF-8 encoded string
+
+		revid - the revision id
+		sha1 - the sha1 hash of the content, as returned by the API,
+		if given, the content is only returned if the hash matches
+
+		Returns None if the revision is not in the cache
+
+		"""
+		filename = self.__filename(revid)
+		try:
+			f = open(filename, 'rb')
+			try:
+				text = zlib.decompress(f.read())
+			finally:
+				f.close()
+		except (IOError, zlib.error):
+			return None
+		if sha1 is not None and sha1hash(text).hexdigest() != sha1:
+			self.remove(revid)
+			return None
+		try:
+			os.utime(filename, None) # For LRU eviction
+		except OSError:
+			pass
+		return text
+
+	def put(self, revid, text, sha1=None):
+		"""Add the content of a revision to the cache
+
+		revid - the revision id
+		text - the content as a unicode object or UTF-8 encoded string
+		sha1 - the sha1 hash of the content, as returned by the API,
+		if given, the content is only stored if the hash matches
+
+		Returns True if the content was stored
+
+		"""
+		if isinstance(text, unicode):
+			text = text.encode('utf-8')
+		if sha1 is not None and sha1hash(text).hexdigest() != sha1:
+			return False
+		filename = self.__filename(revid)
+		dirname = os.path.dirname(filename)
+		data = zlib.compress(text)
+		self.lock.acquire()
+		try:
+			if self.size is None:
+				self.size = self.__getSize()
+			if not os.path.isdir(dirname):
+				os.makedirs(dirname)
+			if os.path.exists(filename):
+				self.size -= os.path.getsize(filename)
+			# Write to a temporary file first so partial writes are never read
+			tmpname = '%s.%d.tmp' % (filename, thread.get_ident())
+			f = open(tmpname, 'wb')
+			try:
+				f.write(data)
+			finally:
+				f.close()
+			if os.name == 'nt' and os.path.exists(filename):
+				os.remove(filename)
+			os.rename(tmpname, filename)
+			self.size += len(data)
+			if self.size > self.maxsize:
+				self.__evict()
+		finally:
+			self.lock.release()
+		return True
+
+	def remove(self, revid):
+		"""Remove a revision from the cache"""
+		filename = self.__filename(revid)
+		self.lock.acquire()
+		try:
+			try:
+				size = os.path.getsize(filename)
+				os.remove(filename)
+			except OSError:
+				return
+			if self.size is not None:
+				self.size -= size
+		finally:
+			self.lock.release()
+
+	def clear(self):
+		"""Remove everything from the cache"""
+		self.lock.acquire()
+		try:
+			for (filename, mtime, size) in self.__listFiles():
+				os.remove(filename)
+			self.size = 0
+		finally:
+			self.lock.release()
+
+	def __contains__(self, revid):
+		return os.path.exists(self.__filename(revid))
+
+	def __filename(self, revid):
+		revid = int(revid)
+		# Spread over subdirectories so no directory gets too big
+		return os.path.join(self.path, '%03d' % (revid % 1000), '%d.z' % revid)
+
+	def __listFiles(self):
+		files = []
+		for (dirpath, dirnames, filenames) in os.walk(self.path):
+			for filename in filenames:
+				if not filename.endswith('.z'):
+					continue
+				filename = os.path.join(dirpath, filename)
+				try:
+					st = os.stat(filename)
+				except OSError:
+					continue
+				files.append((filename, st.st_mtime, st.st_size))
+		return files
+
+	def __getSize(self):
+		return sum([size for (filename, mtime, size) in self.__listFiles()])
+
+	def __evict(self):
+		# Go down to 90% of the limit so this doesn't run on every put
+		target = self.maxsize * 0.9
+		files = self.__listFiles()
+		files.sort(key=lambda f: f[1])
+		self.size = sum([f[2] for f in files])
+		for (filename, mtime, size) in files:
+			if self.size <= target:
+				break
+			try:
+				os.remove(filename)
+			except OSError:
+				continue
+			self.size -= size
+
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+repr(self.path)+">"
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright 2008-2013 Alex Zaddach (mrzmanwiki@gmail.com)
+
+# This file is part of wikitools.
+# wikitools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# wikitools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with wikitools.  If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+import weakref
+import threading
+
+try:
+	import lz4.block as lz4block
+except ImportError:
+	lz4block = None
+
+class TextStore(object):
+	"""Compressed in-memory storage for the wikitext of Page objects
+
+	To use it, pass it to Wiki.setTextStore. The wikitext of pages on
+	that wiki is then kept compressed and only decompressed when it's
+	used. When the total compressed size goes over the limit, the text of
+	the least recently used pages is dropped and is loaded again (from
+	the revision cache if there is one) the next time getWikiText is called.
+
+	"""
+	def __init__(self, maxsize=256*1024*1024, method=None):
+		"""
+		maxsize - approximate maximum size of the compressed text in bytes
+		method - 'zlib' or 'lz4', defaults to lz4 if the lz4 module is installed
+		"""
+		if method is None:
+			if lz4block is not None:
+				method = 'lz4'
+			else:
+				method = 'zlib'
+		if method == 'lz4' and lz4block is None:
+			raise ImportError("The lz4 module is not installed")
+		if method not in ('zlib', 'lz4'):
+			raise ValueError("Invalid compression method: "+repr(method))
+		self.method = method
+		self.maxsize = maxsize
+		self.size = 0
+		self.items = {} # id of the owner -> [data, isunicode, lastused, weakref to the owner]
+		self.counter = 0
+		# Reentrant, since a garbage collection while the lock is held can call __collected
+		self.lock = threading.RLock()
+
+	def get(self, owner):
+		"""Get the text stored for an object, or None if there is none"""
+		self.lock.acquire()
+		try:
+			item = self.items.get(id(owner))
+			if item is None or item[3]() is not owner:
+				return None
+			self.counter += 1
+			item[2] = self.counter
+			(data, isunicode) = (item[0], item[1])
+		finally:
+			self.lock.release()
+		text = self.__decompress(data)
+		if isunicode:
+			text = text.decode('utf-8')
+		return text
+
+	def put(self, owner, text):
+		"""Store the text for an object, replacing any previous text
+
+		Empty text removes the object from the store
+
+		"""
+		if not text:
+			self.discard(owner)
+			return
+		isunicode = isinstance(text, unicode)
+		if isunicode:
+			text = text.encode('utf-8')
+		data = self.__compress(text)
+		key = id(owner)
+		self.lock.acquire()
+		try:
+			self.__remove(key)
+			self.counter += 1
+			ref = weakref.ref(owner, lambda r, key=key: self.__collected(key, r))
+			self.items[key] = [data, isunicode, self.counter, ref]
+			self.size += len(data)
+			if self.size > self.maxsize:
+				self.__evict(key)
+		finally:
+			self.lock.release()
+
+	def discard(self, owner):
+		"""Remove the text for an object from the store"""
+		self.lock.acquire()
+		try:
+			item = self.items.get(id(owner))
+			if item is not None and item[3]() is owner:
+				self.__remove(id(owner))
+		finally:
+			self.lock.release()
+
+	def clear(self):
+		"""Remove everything from the store"""
+		self.lock.acquire()
+		try:
+			self.items = {}
+			self.size = 0
+		finally:
+			self.lock.release()
+
+	def __collected(self, key, ref):
+		# The owner was garbage collected, the id may be reused
+		self.lock.acquire()
+		try:
+			item = self.items.get(key)
+			if item is not None and item[3] is ref:
+				self.__remove(key)
+		finally:
+			self.lock.release()
+
+	def __remove(self, key):
+		item = self.items.pop(key, None)
+		if item is not None:
+			self.size -= len(item[0])
+
+	def __evict(self, keep):
+		# Go down to 90% of the limit so this doesn't run on every put.
+		# The text that was just stored is kept, even if it's over the limit
+		target = self.maxsize * 0.9
+		items = self.items.items()
+		items.sort(key=lambda i: i[1][2])
+		for (key, item) in items:
+			if self.size <= target:
+				break
+			if key != keep:
+				self.__remove(key)
+
+	def __compress(self, text):
+		if self.method == 'lz4':
+			return lz4block.compress(text)
+		return zlib.compress(text)
+
+	def __decompress(self, data):
+		if self.method == 'lz4':
+			return lz4block.decompress(data)
+		return zlib.decompress(data)
+
+	def __contains__(self, owner):
+		item = self.items.get(id(owner))
+		return item is not None and item[3]() is owner
+
+	def __len__(self):
+		return len(self.items)
+
+	def __repr__(self):
+		return "<"+self.__module__+'.'+self.__class__.__name__+" "+str(len(self.items))+" texts, "+str(self.size)+" bytes>"
@@ -21,7 +21,10 @@ import api
 import socket
 import re
 
-class User:
+# The contribution data returned by default by User.iterContribs
+contribProps = ('ids', 'title', 'timestamp', 'comment', 'size', 'flags')
+
+class User(object):
 	"""A user on the wiki"""
 	def __init__(self, site, name, check=True):
 		"""
@@ -38,11 +41,152 @@ class User:
 		self.editcount = -1
 		self.groups = []
 		self.id = 0
+		self.registration = None
 		if check:
 			self.setUserInfo()
 		self.isIP = False
 		self.IPcheck()
-		self.page = page.Page(self.site, ':'.join([self.site.namespaces[2]['*'], self.name]), check=check, followRedir=False)
+		self.pagecheck = check
+		self._page = None # Made the first time it's used
+	
+	def __getPage(self):
+		if self._page is None:
+			self._page = page.Page(self.site, ':'.join([self.site.namespaces[2]['*'], self.name]), check=self.pagecheck, followRedir=False)
+		return self._page
+	
+	def __setPage(self, userpage):
+		self._page = userpage
+	
+	# The user page, only made when it's used
+	page = property(__getPage, __setPage)
+	
+	@staticmethod
+	def loadMany(site, names, batch=50, workers=1, pages=True):
+		"""Load the info of many users in batched queries
+		
+		site - A wiki object
+		names - list of usernames and/or User objects
+		batch - number of users to get per request, at most 50
+		(500 for users with the apihighlimits right)
+		workers - number of requests to run concurrently
+		pages - also check which user pages exist, also in batches
+		
+		Gets the same info as setUserInfo, plus the registration date.
+		Returns a list of User objects in the same order as names,
+		names are converted to User objects.
+		
+		"""
+		import pagelist
+		users = []
+		for name in names:
+			if not isinstance(name, User):
+				name = User(site, name, check=False)
+			users.append(name)
+		batch = max(1, min(int(batch), int(site.limit)/10))
+		named = [u for u in users if not u.isIP]
+		jobs = [named[x:x+batch] for x in range(0, len(named), batch)]
+		def getBatch(job):
+			bykey = {}
+			for u in job:
+				bykey.setdefault(User.__key(u.name), []).append(u)
+			params = {
+				'action': 'query',
+				'list': 'users',
+				'ususers':'|'.join([u.name for u in job]),
+				'usprop':'blockinfo|groups|editcount|registration'
+			}
+			req = api.APIRequest(site, params)
+			res = req.query(False)
+			for info in res['query']['users']:
+				for u in bykey.get(User.__key(info['name']), []):
+					u._setFromQuery(info)
+			return []
+		for x in api.threadedGen(getBatch, jobs, workers):
+			pass
+		if pages:
+			userpages = []
+			for u in users:
+				u.pagecheck = False
+				try:
+					userpages.append(u.page)
+				except page.BadTitle:
+					pass # Invalid username
+			pagelist.loadProps(site, userpages, ['info'], batch, workers)
+		return users
+	
+	@staticmethod
+	def __key(name):
+		# list=users doesn't say how it normalized the names
+		name = name.replace('_', ' ').strip()
+		return name[:1].upper() + name[1:]
+	
+	def iterContribs(self, start=None, end=None, namespaces=False, props=contribProps, direction='older', prefetch=False):
+		"""Generator function for the user's contributions
+		
+		start/end - Only get contributions between these timestamps, given as
+			datetime objects or strings in the API's format
+		namespaces - list of namespaces to get contributions in
+		props - list of data to get for each edit, from the ucprop options of
+			list=usercontribs, defaults to contribProps
+		direction - 'older' (default) to start with the newest edit, 'newer' to
+			start with the oldest
+		prefetch - request the next batch in a background thread while the
+			current one is being processed
+		
+		Edits are requested in batches of the largest size the API allows and
+		yielded one at a time as dicts in the API's format, so the full list is
+		never stored in memory.
+		
+		"""
+		return User.iterContribsMany(self.site, [self], start, end, namespaces, props, direction, prefetch)
+	
+	@staticmethod
+	def iterContribsMany(site, names, start=None, end=None, namespaces=False, props=contribProps, direction='older', prefetch=False, batch=50):
+		"""Generator function for the contributions of many users
+		
+		site - A wiki object
+		names - list of usernames and/or User objects
+		batch - number of users to get per enumeration, at most 50
+		(500 for users with the apihighlimits right)
+		
+		The other options are the same as iterContribs. The users are
+		combined in the ucuser parameter, so a batch of users is covered by one
+		enumeration. Within a batch, the edits of all the users are sorted
+		by timestamp, the 'user' field says whose edit it is.
+		
+		"""
+		if direction != 'newer' and direction != 'older':
+			raise wiki.WikiError("direction must be 'newer' or 'older'")
+		params = {'action':'query',
+			'list':'usercontribs',
+			'ucprop':'|'.join(props),
+			'ucdir':direction,
+			'uclimit':site.limit
+		}
+		if start:
+			params['ucstart'] = page.apiTimestamp(start)
+		if end:
+			params['ucend'] = page.apiTimestamp(end)
+		if namespaces is not False:
+			params['ucnamespace'] = '|'.join([str(ns) for ns in namespaces])
+		names = [getattr(name, 'name', name) for name in names]
+		batch = max(1, min(int(batch), int(site.limit)/10))
+		jobs = [names[x:x+batch] for x in range(0, len(names), batch)]
+		batches = User.__getContribBatches(site, params, jobs)
+		if prefetch:
+			batches = api.prefetchGen(batches)
+		for contribs in batches:
+			for contrib in contribs:
+				yield contrib
+	
+	@staticmethod
+	def __getContribBatches(site, params, jobs):
+		for job in jobs:
+			jobparams = dict(params)
+			jobparams['ucuser'] = '|'.join(job)
+			req = api.APIRequest(site, jobparams)
+			for data in req.queryGen():
+				yield data['query']['usercontribs']
 	
 	def IPcheck(self):
 		try: #IPv4 check
@@ -64,8 +208,15 @@ class User:
 			pass
 
 	def IPnorm(self, ip):
-		"""This is basically a port of MediaWiki's IP::sanitizeIP but assuming no CIDR ranges"""
-		ip = ip.upper()
+		"""This is basically a port of MediaWiki's IP::sanitizeIP"""
+		ip = ip.strip().upper()
+		bits = ''
+		if '/' in ip:
+			(ip, bits) = ip.split('/', 1)
+			bits = '/'+bits
+		if ':' not in ip:
+			# IPv4, remove leading zeros from each octet
+			return '.'.join([re.sub('^0+(?=[0-9])', '', octet) for octet in ip.split('.')])+bits
 		# Expand zero abbreviations
 		abbrevPos = ip.find('::')
 		if abbrevPos != -1:
@@ -85,8 +236,8 @@ class User:
 				pad = 8
 			ip = ip.replace( '::', repeat*(pad-ip.count(':'))+extra)
 		# Remove leading zereos from each bloc as needed
-		ip = re.sub('/(^|:)0+(([0-9A-Fa-f]{1,4}))/', '\1\2', ip)
-		return ip;
+		ip = re.sub('(^|:)0+([0-9A-F]{1,4})', r'\1\2', ip)
+		return ip+bits
 
 	def setUserInfo(self):
 		"""Sets basic user info"""		
@@ -94,33 +245,47 @@ class User:
 			'action': 'query',
 			'list': 'users',
 			'ususers':self.name,
-			'usprop':'blockinfo|groups|editcount'
+			'usprop':'blockinfo|groups|editcount|registration'
 		}
 		req = api.APIRequest(self.site, params)
 		response = req.query(False)
-		user = response['query']['users'][0]
+		self._setFromQuery(response['query']['users'][0])
+		return self
+	
+	def _setFromQuery(self, user):
+		"""Set the user info from one user of a list=users result"""
 		self.name = user['name']
 		if 'missing' in user or 'invalid' in user:
 			self.exists = False
 			return
+		self.exists = True
 		self.id = int(user['userid'])
 		self.editcount = int(user['editcount'])
+		self.registration = user.get('registration')
 		if 'groups' in user:
 			self.groups = user['groups']
 		if 'blockedby' in user:
 			self.blocked = True
 		else:
 			self.blocked = False
-		return self
 		
 	def getTalkPage(self, check=True, followRedir=False):
 		"""Convenience function to get an object for the user's talk page"""
 		return page.Page(self.site, ':'.join([self.site.namespaces[3]['*'], self.name]), check=check, followRedir=False)
 		
-	def isBlocked(self, force=False):
-		"""Determine if a user is blocked"""
+	def isBlocked(self, force=False, index=None):
+		"""Determine if a user is blocked
+		
+		force - check again even if it's already known
+		index - a loaded blockindex.BlockIndex to check instead of making a
+		request, this includes range blocks for IP addresses
+		
+		"""
 		if self.blocked is not None and not force:
 			return self.blocked
+		if index is not None:
+			self.blocked = index.isBlocked(self.name)
+			return self.blocked
 		params = {'action':'query',
 			'list':'blocks',
 			'bkusers':self.name,
@@ -199,7 +364,7 @@ class User:
 		return res
 	
 	def __hash__(self):
-		return int(self.name) ^ hash(self.site.apibase)
+		return hash(self.name) ^ hash(self.site.apibase)
 	
 	def __eq__(self, other):
 		if not isinstance(other, User):
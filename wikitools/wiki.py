@@ -22,6 +22,8 @@ import re
 import time
 import os
 import warnings
+import weakref
+import urllib2
 from urlparse import urlparse
 from urllib2 import HTTPPasswordMgrWithDefaultRealm
 try:
@@ -89,8 +91,15 @@ class Wiki:
 		self.siteinfo = {}
 		self.namespaces = {}
 		self.NSaliases = {}
+		self.nsindex = {} # Built by page.namespaceIndex when needed
 		self.assertval = None
 		self.newtoken = False
+		self.revcache = None
+		self.textstore = None
+		self.tokens = {}
+		self.registry = None
+		self.opener = None # See getOpener
+		self.openercookies = None
 		try:
 			self.setSiteinfo()
 		except api.APIError: # probably read-restricted
@@ -126,6 +135,7 @@ class Wiki:
 			else:
 				attr = "NS_MAIN"
 			setattr(self, attr.encode('utf8'), Namespace(ns.encode('utf8')))			
+		self.nsindex = {}
 		nsaliasdata = info['query']['namespacealiases']
 		if nsaliasdata:
 			for ns in nsaliasdata:
@@ -184,11 +194,13 @@ class Wiki:
 		info = req.query()
 		if info['login']['result'] == "Success":
 			self.username = username
+			self.tokens = {}
 		elif info['login']['result'] == "NeedToken":
 			req.changeParam('lgtoken', info['login']['token'])
 			info = req.query()
 			if info['login']['result'] == "Success":
 				self.username = username
+				self.tokens = {}
 			else:
 				return loginerror(info)
 		else:
@@ -229,6 +241,7 @@ class Wiki:
 		req.opener.open(req.request)
 		self.cookies = WikiCookieJar()
 		self.username = ''
+		self.tokens = {}
 		self.maxlag = 5
 		self.useragent = "python-wikitools/%s" % VERSION
 		self.limit = 500
@@ -292,7 +305,62 @@ class Wiki:
 		self.assertval = value
 		return self.assertval
 		
-	def getToken(self, type):
+	def setRevisionCache(self, cache):
+		"""Set a cache for revision content
+		
+		cache - a revcache.RevisionCache object, or None (the default) to not use one
+		
+		When set, revision content is looked up in the cache before it is
+		downloaded and added to it afterwards.
+		
+		"""
+		self.revcache = cache
+		return self.revcache
+
+	def setTextStore(self, store):
+		"""Set a store for the wikitext of Page objects
+
+		store - a textstore.TextStore object, or None (the default) to not use one
+
+		When set, the wikitext of pages is kept compressed in the store. Text
+		already loaded on existing Page objects is kept as it is until it changes.
+
+		"""
+		self.textstore = store
+		return self.textstore
+
+	def getOpener(self):
+		"""Get a URL opener for requests outside the API, e.g. file downloads
+		
+		It uses the wiki's cookies and HTTP digest authentication. It's made
+		once and made again only when the cookies are replaced, e.g. by logout.
+		
+		"""
+		if self.opener is None or self.openercookies is not self.cookies:
+			handlers = [urllib2.HTTPCookieProcessor(self.cookies)]
+			if getattr(self, 'passman', None) is not None:
+				handlers.insert(0, urllib2.HTTPDigestAuthHandler(self.passman))
+			self.opener = urllib2.build_opener(*handlers)
+			self.openercookies = self.cookies
+		return self.opener
+	
+	def setPageRegistry(self, enabled=True):
+		"""Enable or disable the registry of Page objects
+		
+		When enabled, page.getPage and the functions that make lists of pages
+		(pagelist, Category and File members) return the same Page object
+		each time the same page is requested, as long as the object
+		is still in use somewhere, so loaded data is shared.
+		
+		"""
+		if enabled:
+			if self.registry is None:
+				self.registry = weakref.WeakValueDictionary()
+		else:
+			self.registry = None
+		return self.registry is not None
+		
+	def getToken(self, type, force=False):
 		"""Get a token
 		
 		For wikis with MW 1.24 or newer:
@@ -300,7 +368,13 @@ class Wiki:
 
 		For older wiki versions, only csrf (edit, move, etc.) tokens are supported
 		
+		Tokens are valid for the whole session, so they are cached until
+		login() or logout() is called
+		force - get a new token even if one is cached
+		
 		"""
+		if type in self.tokens and not force:
+			return self.tokens[type]
 		if self.newtoken:
 			params = {
 				'action':'query',
@@ -327,6 +401,7 @@ class Wiki:
 			else:
 				pages = response['query']['pages']
 				token = pages.itervalues().next()['edittoken']
+		self.tokens[type] = token
 		return token
 
 
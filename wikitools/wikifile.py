@@ -20,6 +20,10 @@ import page
 import api
 import urllib2
 import warnings
+import hashlib
+import base64
+import os
+from urlparse import urlparse
 
 class FileDimensionError(wiki.WikiError):
 	"""Invalid dimensions"""
@@ -27,9 +31,12 @@ class FileDimensionError(wiki.WikiError):
 class UploadError(wiki.WikiError):
 	"""Error during uploading"""
 
+class DownloadError(wiki.WikiError):
+	"""Downloaded file doesn't match the size or hash given by the API"""
+
 class File(page.Page):
 	"""A file on the wiki"""
-	def __init__(self, wiki, title, check=True, followRedir=False, section=False, sectionnumber=False, pageid=False):
+	def __init__(self, wiki, title, check=True, followRedir=False, section=False, sectionnumber=None, pageid=False):
 		"""	
 		wiki - A wiki object
 		title - The page title, as a string or unicode object
@@ -42,7 +49,7 @@ class File(page.Page):
 		page.Page.__init__(self, wiki, title, check, followRedir, section, sectionnumber, pageid)
 		if self.namespace != 6:
 			self.setNamespace(6, check)
-		self.usage = []
+		self.usage = page.PageIndex()
 		self.filehistory = []
 
 	def getHistory(self, force=False):
@@ -71,64 +78,50 @@ class File(page.Page):
 				self.filehistory.append(item)
 		return self.filehistory
 			
-	def getUsage(self, titleonly=False, force=False, namespaces=False):
+	def getUsage(self, titleonly=False, force=False, namespaces=False, refonly=False):
 		"""Gets a list of pages that use the file
 		
 		titleonly - set to True to only create a list of strings,
 		else it will be a list of Page objects
 		force - reload the list even if it was generated before
-		namespaces - List of namespaces to restrict to (queries with this option will not be cached)
+		namespaces - List of namespaces to restrict to
+		refonly - set to True to create a list of page.PageRef objects, which use
+		much less memory than Page objects (queries with this option will not be cached)
+		
+		Page objects are cached in self.usage, a page.PageIndex, separately for
+		each namespace, so only namespaces that weren't loaded before are queried.
 		
 		"""
-		if self.usage and not reload:
-			if titleonly:
-				if namespaces is not False:
-					return [p.title for p in self.usage if p.namespace in namespaces]
-				else:
-					return [p.title for p in self.usage]
-			if namespaces is False:
-				return self.usage
-			else:
-				return [p for p in self.usage if p.namespace in namespaces]
-		else:
-			ret = []
-			usage = []
-			for title in self.__getUsageInternal(namespaces):
-				usage.append(title)
-				if titleonly:
-					ret.append(title.title)
-			if titleonly:
-				return ret
-			if namespaces is False:
-				self.usage = usage
-			return usage
+		usage = list(self.getUsageGen(titleonly, force, namespaces, refonly))
+		if namespaces is False and not titleonly and not refonly:
+			return self.usage
+		return usage
 	
-	def getUsageGen(self, titleonly=False, force=False, namespaces=False):
+	def getUsageGen(self, titleonly=False, force=False, namespaces=False, refonly=False):
 		"""Generator function for pages that use the file
 		
 		titleonly - set to True to return strings,
 		else it will return Page objects
 		force - reload the list even if it was generated before
-		namespaces - List of namespaces to restrict to (queries with this option will not be cached)
+		namespaces - List of namespaces to restrict to
+		refonly - set to True to return page.PageRef objects, which use
+		much less memory than Page objects (queries with this option will not be cached)
 		
 		"""
-		if self.usage and not reload:
-			for title in self.usage:
-				if namespaces is False or title.namespace in namespaces:
-					if titleonly:
-						yield title.title
-					else:
-						yield title
-		else:
-			if namespaces is False:
-				self.usage = []
-			for title in self.__getUsageInternal():
-				if namespaces is False:
-					self.usage.append(title)
+		if force:
+			self.usage.clear()
+		if refonly or (titleonly and not self.usage.covers(namespaces)):
+			for title in self.__getUsageInternal(namespaces):
 				if titleonly:
 					yield title.title
 				else:
 					yield title
+			return
+		for title in self.usage.fill(namespaces, self.__getUsageInternal):
+			if titleonly:
+				yield title.title
+			else:
+				yield title
 				
 	def __getUsageInternal(self, namespaces=False):
 		params = {'action':'query',
@@ -138,15 +131,10 @@ class File(page.Page):
 		}
 		if namespaces is not False:
 			params['iunamespace'] = '|'.join([str(ns) for ns in namespaces])
-		while True:
-			req = api.APIRequest(self.site, params)
-			data = req.query(False)
+		req = api.APIRequest(self.site, params)
+		for data in req.queryGen():
 			for item in data['query']['imageusage']:
-				yield page.Page(self.site, item['title'], check=False, followRedir=False)
-			try:
-				params['iucontinue'] = data['query-continue']['imageusage']['iucontinue']
-			except:
-				break 
+				yield page.PageRef(self.site, item['title'], item['pageid'], item['ns'])
 		
 	def __extractToList(self, json, stuff):
 		list = []
@@ -155,19 +143,27 @@ class File(page.Page):
 				list.append(item['title'])
 		return list
 	
-	def download(self, width=False, height=False, location=False):
+	def download(self, width=False, height=False, location=False, chunksize=1024*1024, resume=True):
 		"""Download the image to a local file
 		
 		width/height - set width OR height of the downloaded image
 		location - set the filename to save to. If not set, the page title
 		minus the namespace prefix will be used and saved to the current directory
+		chunksize - number of bytes to read and write at a time
+		resume - if a previous download was interrupted, continue it instead
+		of starting over
+		
+		The file is written to location + '.part' and renamed to location when
+		it's complete, so an interrupted download never leaves a partial file
+		at location. Full-size downloads are checked against the size and SHA-1
+		hash from the API, raising DownloadError if they don't match.
 		
 		"""
 		if self.pageid == 0:
 			self.setPageInfo()
 		params = {'action':'query',
 			'prop':'imageinfo',
-			'iiprop':'url'
+			'iiprop':'url|size|sha1'
 		}
 		if width and height:
 			raise FileDimensionError("Can't specify both width and height")
@@ -188,17 +184,77 @@ class File(page.Page):
 		req = api.APIRequest(self.site, params)
 		res = req.query(False)
 		key = res['query']['pages'].keys()[0]
-		url = res['query']['pages'][key]['imageinfo'][0]['url']
+		info = res['query']['pages'][key]['imageinfo'][0]
+		# The size and hash are for the original file, not thumbnails
+		if 'thumburl' in info:
+			(url, size, sha1) = (info['thumburl'], None, None)
+		else:
+			(url, size, sha1) = (info['url'], info.get('size'), info.get('sha1'))
 		if not location:
 			location = self.title.split(':', 1)[1]
-		opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.site.cookies))
+		partfile = location + '.part'
+		digest = hashlib.sha1()
+		offset = 0
+		if resume and os.path.exists(partfile):
+			f = open(partfile, 'rb')
+			try:
+				while True:
+					chunk = f.read(chunksize)
+					if not chunk:
+						break
+					digest.update(chunk)
+					offset += len(chunk)
+			finally:
+				f.close()
+		if size is not None and offset > size:
+			(digest, offset) = (hashlib.sha1(), 0)
+		if size is None or offset < size:
+			data = self.__openDownload(url, offset)
+			if data is None or offset and getattr(data, 'code', 200) != 206:
+				# The server doesn't support ranges, or the part file is bad
+				if data is None:
+					data = self.__openDownload(url, 0)
+				(digest, offset) = (hashlib.sha1(), 0)
+			if offset:
+				f = open(partfile, 'ab')
+			else:
+				f = open(partfile, 'wb')
+			try:
+				while True:
+					chunk = data.read(chunksize)
+					if not chunk:
+						break
+					f.write(chunk)
+					digest.update(chunk)
+					offset += len(chunk)
+			finally:
+				f.close()
+				data.close()
+		if (size is not None and offset != size) or (sha1 and digest.hexdigest() != sha1):
+			os.remove(partfile)
+			raise DownloadError("Downloaded file doesn't match the size or SHA-1 hash of "+repr(self.title))
+		if os.name == 'nt' and os.path.exists(location):
+			os.remove(location) # Windows can't rename over an existing file
+		os.rename(partfile, location)
+		return location
+	
+	def __openDownload(self, url, offset):
+		# Returns None if the range can't be satisfied
+		opener = self.site.getOpener()
 		headers = { "User-agent": self.site.useragent }
+		# Files are often on another host, only send the wiki's password to the wiki
+		if self.site.auth and urlparse(url).netloc == urlparse(self.site.apibase).netloc:
+			headers['Authorization'] = "Basic {0}".format(
+				base64.encodestring(self.site.auth + ":" + self.site.httppass)).replace('\n','')
+		if offset:
+			headers['Range'] = 'bytes=%d-' % offset
 		request = urllib2.Request(url, None, headers)
-		data = opener.open(request)
-		f = open(location, 'wb', 0)
-		f.write(data.read())
-		f.close()
-		return location
+		try:
+			return opener.open(request)
+		except urllib2.HTTPError, e:
+			if e.code == 416 and offset:
+				return None
+			raise
 		
 	def upload(self, fileobj=None, comment='', url=None, ignorewarnings=False, watch=False):
 		"""Upload a file, requires the "poster" module